@@ -0,0 +1,214 @@
+import re
+import bisect
+from abc import ABC, abstractmethod
+from itertools import compress
+
+from lua_lexer import KIND_CODE
+
+# name -> Backend instance, in registration order; the first one is the default
+BACKENDS = {}
+
+def register(cls):
+    """
+    Class decorator adding an instance of a Backend subclass to BACKENDS under its name.
+    A subclass missing extract() or decode_all() fails here, when it is instantiated.
+    """
+    BACKENDS[cls.name] = cls()
+    return cls
+
+class Backend(ABC):
+    """
+    Decoder for one obfuscator family. The pipeline around it is shared: Pass 2 asks the
+    backend for its encoded pool and keys, picks the VM function from its `name(<int>)` call
+    sites, and Pass 3 hands the backend every offset those calls use.
+
+    fingerprints lists (token kind, pattern, weight): a token of that kind whose text matches
+    pattern from its first character is evidence for the backend, counted once per fingerprint.
+    detect() evaluates every registered backend's fingerprints in a single pass over the tokens.
+    """
+    name = None
+    fingerprints = ()
+
+    @abstractmethod
+    def extract(self, stream, sig, kinds, vals, keys=None, pool=None):
+        """
+        (pool bytes, keys) from the folded stream, as seen through its significant tokens
+        (sig, and their parallel kinds / clipped vals). keys or pool given by the caller are
+        used as-is. Raises ValueError when either cannot be found.
+        """
+
+    @abstractmethod
+    def decode_all(self, pool, keys, offsets):
+        """{offset: string} for every decodable offset."""
+
+def _fingerprint_table(backends):
+    """Per token kind, one pattern testing every fingerprint of that kind at once, as (regex, groups)."""
+    by_kind, n = {}, 0
+    for b, backend in enumerate(backends):
+        for kind, pattern, weight in backend.fingerprints:
+            by_kind.setdefault(KIND_CODE[kind], []).append((f'f{n}', pattern, b, weight))
+            n += 1
+    table = {}
+    for code, fps in by_kind.items():
+        # Each fingerprint is an optional lookahead, so one match reports all of them
+        regex = re.compile(''.join(f'(?:(?=(?P<{group}>{pattern})))?' for group, pattern, _, _ in fps))
+        table[code] = regex, {group: (b, weight) for group, _, b, weight in fps}
+    return table
+
+def detect(stream, backends=None):
+    """
+    Scores backends (default: all registered) by their fingerprints in one pass over the
+    stream's tokens. Returns (score, backend) pairs, best first; ties keep registration order.
+    """
+    backends = list(BACKENDS.values()) if backends is None else list(backends)
+    table = _fingerprint_table(backends)
+    scores = [0] * len(backends)
+    pending = {name for _, groups in table.values() for name in groups}
+    wanted = bytes(1 if k in table else 0 for k in range(256))
+    kinds = stream.kinds
+    for i in compress(range(len(kinds)), kinds.tobytes().translate(wanted)):
+        regex, groups = table[kinds[i]]
+        m = regex.match(*stream.span(i))
+        if m.lastindex is None: continue
+        for name, value in m.groupdict().items():
+            if value is not None and name in pending:
+                pending.discard(name)
+                b, weight = groups[name]
+                scores[b] += weight
+        if not pending: break
+    ranked = sorted(range(len(backends)), key=lambda b: -scores[b])
+    return [(scores[b], backends[b]) for b in ranked]
+
+def choose(stream, name=None):
+    """The backend named `name`, else the best fingerprint match, else the default; returns (backend, score)."""
+    if name:
+        if name not in BACKENDS: raise ValueError(f"Unknown backend: {name}")
+        return BACKENDS[name], None
+    score, backend = detect(stream)[0]
+    return (backend, score) if score else (next(iter(BACKENDS.values())), 0)
+
+# -- XHider --
+
+# XOR_TABLES[k] maps every byte b to b ^ k, so a whole key phase decodes with one bytes.translate
+XOR_TABLES = [bytes(b ^ k for b in range(256)) for k in range(256)]
+# lua_vm_decode_all XORs the pool this many bytes at a time per key phase, when the window
+# holds at least WINDOW_RECORDS of the wanted records (a window costs about as much as XORing
+# 30-40 records on their own); sparser records are XORed one by one
+XOR_WINDOW = 1 << 16
+WINDOW_RECORDS = 40
+
+def _as_view(hex_pool):
+    """Zero-copy view of a pool given as bytes, bytearray or memoryview (lists of ints are converted once)."""
+    return memoryview(hex_pool if isinstance(hex_pool, (bytes, bytearray, memoryview)) else bytes(hex_pool))
+
+def _xor_record(pool, keys, start, end):
+    """Decodes pool[start:end] as a record beginning at key phase 0; copies only that slice."""
+    out = bytearray(pool[start:end])
+    for j in range(4): out[j::4] = out[j::4].translate(XOR_TABLES[keys[j] & 0xFF])
+    return out
+
+def lua_vm_decode(hex_pool, keys, offset):
+    """Simulates XHider Lua VM decoding of a single string."""
+    pool = _as_view(hex_pool)
+    o = int(offset)
+    if o + 4 > len(pool): return None
+    length = int.from_bytes(_xor_record(pool, keys, o, o + 4), 'little')
+    if o + 4 + length > len(pool): return None
+    return _xor_record(pool, keys, o + 4, o + 4 + length).decode('latin-1')
+
+def lua_vm_decode_all(hex_pool, keys, offsets):
+    """
+    Batch XHider decoder over one shared view of the pool. Offsets are grouped by key
+    phase (offset % 4); where a group's records are dense, the pool is XORed a window of
+    XOR_WINDOW bytes at a time and those records are plain slices of it. Peak memory is
+    the pool, one window and the decoded strings.
+    Returns {offset: string} for each decodable offset.
+    """
+    pool = _as_view(hex_pool)
+    n = len(pool)
+    phases = ([], [], [], [])
+    for o in offsets:
+        o = int(o)
+        phases[o % 4].append(o)
+    results = {}
+    for group in phases:
+        group.sort()
+        limit = -1
+        for i, o in enumerate(group):
+            if o + 4 > limit:
+                if o + 4 > n: break  # and so is every later offset
+                if bisect.bisect_left(group, o + XOR_WINDOW, i) - i < WINDOW_RECORDS:
+                    length = int.from_bytes(_xor_record(pool, keys, o, o + 4), 'little')
+                    if o + 4 + length <= n: results[o] = _xor_record(pool, keys, o + 4, o + 4 + length).decode('latin-1')
+                    continue
+                # The window starts key phase 0, as does every record of this group
+                base, limit = o, min(n, o + XOR_WINDOW)
+                window = memoryview(_xor_record(pool, keys, base, limit))
+            r = o - base + 4
+            end = r + int.from_bytes(window[r - 4:r], 'little')
+            if base + end <= limit: results[o] = str(window[r:end], 'latin-1')
+            elif base + end <= n: results[o] = _xor_record(pool, keys, o + 4, base + end).decode('latin-1')
+    return results
+
+HEX_POOL_RE = re.compile(r'["\']([0-9a-fA-F]{200,})["\']$')
+HEX_CHUNK = 1 << 20
+
+def hex_span_to_bytes(text, start, end):
+    """Decodes the hex digits text[start:end] into one bytearray, a chunk at a time, without copying the span."""
+    end -= (end - start) % 2
+    out = bytearray((end - start) // 2)
+    for i in range(start, end, 2 * HEX_CHUNK):
+        j = min(end, i + 2 * HEX_CHUNK)
+        out[(i - start) // 2:(j - start) // 2] = bytes.fromhex(text[i:j])
+    return out
+
+def find_hex_pool(stream, sig):
+    """The first string literal made of 200+ hex digits, decoded straight from the source span, or None."""
+    string = KIND_CODE['string']
+    for i in sig:
+        if stream.kinds[i] == string:
+            text, s, e = stream.span(i)
+            m = HEX_POOL_RE.match(text, s, e)
+            if m: return hex_span_to_bytes(text, *m.span(1))
+    return None
+
+# find_keys scans the significant tokens as parallel (kinds, vals) lists, so strings and
+# comments can never produce false matches.
+
+def find_keys(kinds, vals):
+    """The Q-table: the first {a, b, c, d} of four integers, else any run of four integers."""
+    n = len(vals)
+    def run_at(p):
+        if p + 7 > n: return None
+        if all(kinds[q] == 'number' and vals[q].isdigit() for q in range(p, p + 7, 2)) \
+                and all(vals[q] in (',', ';') for q in range(p + 1, p + 7, 2)):
+            return [int(vals[q]) for q in range(p, p + 7, 2)]
+        return None
+    for p, v in enumerate(vals):
+        if v == '{' and kinds[p] == 'op':
+            keys = run_at(p + 1)
+            if keys: return keys
+    for p in range(n):
+        keys = run_at(p)
+        if keys: return keys
+    return None
+
+
+@register
+class XHider(Backend):
+    """XHider's VM: a hex pool of length-prefixed records XORed with a repeating four-byte key."""
+    name = 'xhider'
+    fingerprints = (
+        ('comment', r'--[^\n]*\bXHider\b', 4),
+        ('string', r'["\'][0-9a-fA-F]{200,}["\']', 2),
+    )
+
+    def extract(self, stream, sig, kinds, vals, keys=None, pool=None):
+        pool = pool if pool is not None else find_hex_pool(stream, sig)
+        if pool is None: raise ValueError("Hex pool not found.")
+        keys = keys or find_keys(kinds, vals)
+        if not keys: raise ValueError("Keys not found.")
+        return pool, keys
+
+    def decode_all(self, pool, keys, offsets):
+        return lua_vm_decode_all(pool, keys, offsets)
@@ -0,0 +1,106 @@
+import os
+import sys
+import glob
+import json
+import time
+import signal
+import argparse
+import multiprocessing
+
+from cache import Cache, DEFAULT_DIR
+from profiler import PassProfiler
+from unvm import iter_deobfuscate, output_path, write_output
+
+def collect_inputs(patterns):
+    """Expands directories (recursively) and glob patterns into a sorted list of .lua inputs."""
+    found = set()
+    for pat in patterns:
+        if os.path.isdir(pat):
+            for root, _, files in os.walk(pat):
+                found.update(os.path.join(root, f) for f in files if f.endswith('.lua'))
+        elif any(c in pat for c in '*?['):
+            found.update(p for p in glob.glob(pat, recursive=True) if os.path.isfile(p))
+        elif os.path.isfile(pat):
+            found.add(pat)
+    # Never feed our own output back in
+    return sorted(p for p in found if not p.endswith('.unvm.lua'))
+
+class JobTimeout(Exception):
+    """Raised by the SIGALRM handler; not an OSError, so the cache's I/O fallbacks can't swallow it."""
+
+def _on_timeout(signum, frame):
+    raise JobTimeout()
+
+def process_file(job):
+    """Worker: de-obfuscates one file and returns its summary record. Never raises."""
+    path, timeout, cache_dir, profile = job
+    record = {'file': path, 'status': 'ok', 'output': None, 'vm_function': None,
+              'keys': None, 'strings': 0, 'timings': {}, 'error': None}
+    profiler = PassProfiler() if profile else None
+    start = time.perf_counter()
+    # SIGALRM also interrupts long regex matches; platforms without it run unbounded
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with open(path, 'r', encoding='utf-8') as f: code = f.read()
+        info, out = {}, output_path(path)
+        # A profiled run measures the passes, so it never answers from the output cache
+        cache = Cache(cache_dir) if cache_dir and not profile else None
+        write_output(iter_deobfuscate(code, info, cache=cache, profiler=profiler), out)
+        record.update(info, output=out)
+    except JobTimeout:
+        record.update(status='timeout', error=f"exceeded {timeout}s")
+    except Exception as e:
+        record.update(status='error', error=f"{type(e).__name__}: {e}")
+    finally:
+        if use_alarm: signal.setitimer(signal.ITIMER_REAL, 0)
+    if profiler: record['profile'] = profiler.report()
+    record['elapsed'] = round(time.perf_counter() - start, 6)
+    return record
+
+def run_batch(paths, workers=None, timeout=None, summary=None, cache_dir=None, profile=False):
+    """
+    Runs the full pipeline over every path on a process pool.
+    Each finished file is written to `summary` (a text stream) as one JSON line.
+    Workers share the on-disk cache at cache_dir when given; with profile, every record
+    also carries the detailed per-pass profiler report, and the cache is not used.
+    Returns the list of summary records.
+    """
+    records = []
+    jobs = [(p, timeout, cache_dir, profile) for p in paths]
+    with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+        for record in pool.imap_unordered(process_file, jobs):
+            records.append(record)
+            if summary:
+                summary.write(json.dumps(record) + "\n")
+                summary.flush()
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="De-obfuscate many XHider scripts in parallel.")
+    parser.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('-t', '--timeout', type=float, default=None, help="per-file time limit in seconds")
+    parser.add_argument('-s', '--summary', default=None, help="JSON lines summary file (default: stdout)")
+    parser.add_argument('--no-cache', action='store_true', help="bypass the on-disk cache")
+    parser.add_argument('--clear-cache', action='store_true', help="empty the on-disk cache first")
+    parser.add_argument('--cache-dir', default=DEFAULT_DIR, help="cache location (default: ~/.cache/unvm)")
+    parser.add_argument('--profile', action='store_true', help="add per-pass sizes and counters to each record")
+    args = parser.parse_args()
+
+    if args.clear_cache: Cache(args.cache_dir).clear()
+    paths = collect_inputs(args.inputs)
+    if not paths: print("No .lua files found.", file=sys.stderr); return 1
+
+    out = open(args.summary, 'w', encoding='utf-8') if args.summary else sys.stdout
+    cache_dir = None if args.no_cache else args.cache_dir
+    try: records = run_batch(paths, args.workers, args.timeout, out, cache_dir, args.profile)
+    finally:
+        if args.summary: out.close()
+    ok = sum(1 for r in records if r['status'] == 'ok')
+    print(f"Processed {len(records)} files: {ok} ok, {len(records) - ok} failed.", file=sys.stderr)
+    return 0 if ok == len(records) else 1
+
+if __name__ == "__main__": sys.exit(main())
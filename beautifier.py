@@ -1,141 +1,193 @@
 import re
+import functools
+from collections import deque
 
-def expand_fused(text):
-    """Aggressive but selective fused-word expansion for code chunks."""
-    kw_all = ['local', 'function', 'if', 'while', 'for', 'repeat', 'do', 'then', 'else', 'elseif', 'end', 'until', 'return', 'not', 'and', 'or', 'nil', 'true', 'false', 'in']
-    safe_kws = ['local', 'function', 'return', 'not', 'nil', 'true', 'false']
-    structurals = ['if', 'for', 'while', 'repeat', 'and', 'or', 'do', 'then', 'end', 'until', 'else', 'elseif', 'in']
-    
+KW_ALL = ['local', 'function', 'if', 'while', 'for', 'repeat', 'do', 'then', 'else', 'elseif', 'end', 'until', 'return', 'not', 'and', 'or', 'nil', 'true', 'false', 'in']
+SAFE_KWS = ['local', 'function', 'return', 'not', 'nil', 'true', 'false']
+STRUCTURALS = ['if', 'for', 'while', 'repeat', 'and', 'or', 'do', 'then', 'end', 'until', 'else', 'elseif', 'in']
+
+# Every fused-word rule matches inside a single \w+ run, so expansion is a pure function of each word.
+WORD_RE = re.compile(r'\w+')
+DIGIT_LETTER_RE = re.compile(r'([0-9])([a-zA-Z_])')
+IDENT_START = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+DIGITS = frozenset('0123456789')
+
+# Keyword-keyword automaton: fused word -> indices of the (kw1, kw2) pairs producing it, in rule order
+PAIR_RULES = [(kw1, kw2) for kw1 in KW_ALL for kw2 in KW_ALL]
+PAIR_INDEX = {}
+for _i, (_kw1, _kw2) in enumerate(PAIR_RULES):
+    PAIR_INDEX.setdefault(_kw1 + _kw2, []).append(_i)
+
+def _split_pairs(word, after=-1):
+    """Applies the ordered keyword-pair rules to one word; halves only see later rules."""
+    for i in PAIR_INDEX.get(word, ()):
+        if i > after:
+            kw1, kw2 = PAIR_RULES[i]
+            return _split_pairs(kw1, i) + _split_pairs(kw2, i)
+    return [word]
+
+def _split_prefix(words, kw, follow):
+    out = []
+    n = len(kw)
+    for w in words:
+        if len(w) > n and w.startswith(kw) and w[n] in follow: out += [kw, w[n:]]
+        else: out.append(w)
+    return out
+
+def _split_suffix(words, kw):
+    out = []
+    n = len(kw)
+    for w in words:
+        if len(w) > n and w.endswith(kw) and w[-n - 1] in IDENT_START: out += [w[:-n], kw]
+        else: out.append(w)
+    return out
+
+@functools.lru_cache(maxsize=65536)
+def _expand_word(word):
     # 0. Digit-Letter Split
-    text = re.sub(r'([0-9])([a-zA-Z_])', r'\1 \2', text)
-    
-    # 1. Keyword-Keyword Split
+    words = DIGIT_LETTER_RE.sub(r'\1 \2', word).split(' ')
     for _ in range(2):
-        for kw1 in kw_all:
-            for kw2 in kw_all:
-                if kw1 + kw2 in text:
-                    text = re.sub(r'\b(' + kw1 + r')(' + kw2 + r')\b', r'\1 \2', text)
-            
+        # 1. Keyword-Keyword Split
+        words = [p for w in words for p in _split_pairs(w)]
         # 2. Safe-Keyword-Identifier Split
-        for kw in safe_kws:
-            text = re.sub(r'\b(' + kw + r')([a-zA-Z_])', r'\1 \2', text)
-            text = re.sub(r'([a-zA-Z_])(' + kw + r')\b', r'\1 \2', text)
-
-        # 3. Structural Split
-        for kw in structurals:
-            text = re.sub(r'\b(' + kw + r')([a-zA-Z_])\b', r'\1 \2', text)
-        
+        for kw in SAFE_KWS:
+            words = _split_prefix(words, kw, IDENT_START)
+            words = _split_suffix(words, kw)
+        # 3. Structural Split (keyword plus exactly one letter)
+        for kw in STRUCTURALS:
+            words = [p for w in words for p in ([kw, w[-1]] if len(w) == len(kw) + 1 and w.startswith(kw) and w[-1] in IDENT_START else [w])]
     # 4. Keyword stuck to digits
-    for kw in kw_all:
-        text = re.sub(r'\b(' + kw + r')([0-9])', r'\1 \2', text)
+    for kw in KW_ALL:
+        words = _split_prefix(words, kw, DIGITS)
+    return ' '.join(words)
 
-    return text
+def expand_fused(text):
+    """Aggressive but selective fused-word expansion for code chunks."""
+    return WORD_RE.sub(lambda m: _expand_word(m.group()), text)
 
-def beautify_lua(code):
+# Minified split directives
+SPLIT_STARTS_RE = re.compile(r'\s*\b(local|if|while|for|repeat|return|function|end|until)\b')
+SPLIT_MIDDLES_RE = re.compile(r'\b(then|do|else|elseif)\b\s*')
+
+# Scanner patterns; every match is anchored with a pos argument so the source is never sliced
+LONG_BRACKET_RE = re.compile(r'(--)?\[(=*)\[')
+QUOTED_RE = {
+    '"': re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"?', re.S),
+    "'": re.compile(r"[^'\\]*(?:\\.[^'\\]*)*'?", re.S),
+}
+# A code chunk ends at a quote, a comment or a possible long bracket
+CODE_END_RE = re.compile(r'["\']|--|\[[\[=]')
+
+def tokenize(code):
     """
-    Robust Lua beautifier with minified code support and string protection.
+    Splits code into ('code' | 'string' | 'comment', text) chunks in one linear scan.
+    Strings and comments come out verbatim so formatting never touches them.
     """
-    # 1. Tokenize to protect strings and comments
-    tokens = []
     i = 0
-    while i < len(code):
+    n = len(code)
+    unclosed = set()  # levels whose closing bracket never appears again; searching once is enough
+    while i < n:
         # Long brackets --[[ or [[
-        lb_match = re.match(r'(--)?\[(=*)\[', code[i:])
-        if lb_match:
-            is_comment = lb_match.group(1) is not None
-            equals = lb_match.group(2)
-            end_marker = f']{equals}]'
-            start_pos = i
-            i += lb_match.end()
-            end_pos = code.find(end_marker, i)
-            if end_pos != -1:
-                content = code[start_pos : end_pos + len(end_marker)]
-                tokens.append({'type': 'comment' if is_comment else 'string', 'content': content})
-                i = end_pos + len(end_marker)
+        lb_match = LONG_BRACKET_RE.match(code, i)
+        if lb_match and lb_match.group(2) not in unclosed:
+            end_marker = f"]{lb_match.group(2)}]"
+            end_pos = code.find(end_marker, lb_match.end())
+            if end_pos == -1: unclosed.add(lb_match.group(2))
+            else:
+                j = end_pos + len(end_marker)
+                yield ('comment' if lb_match.group(1) else 'string'), code[i:j]
+                i = j
                 continue
-        
+
         # Single line comment
-        if code[i:i+2] == '--':
-            start_pos = i
-            i = code.find('\n', i)
-            if i == -1: i = len(code)
-            tokens.append({'type': 'comment', 'content': code[start_pos:i]})
+        if code.startswith('--', i):
+            j = code.find('\n', i)
+            if j == -1: j = n
+            yield 'comment', code[i:j]
+            i = j
             continue
-            
-        # Standard String
-        if code[i] in ('"', "'"):
-            marker = code[i]
-            start_pos = i
-            i += 1
-            while i < len(code):
-                if code[i] == marker and code[i-1] != '\\':
-                    break
-                i += 1
-            tokens.append({'type': 'string', 'content': code[start_pos:i+1]})
-            i += 1
+
+        # Standard String (escapes, including escaped backslashes, are skipped as pairs)
+        c = code[i]
+        if c == '"' or c == "'":
+            j = QUOTED_RE[c].match(code, i + 1).end()
+            yield 'string', code[i:j]
+            i = j
             continue
-            
-        # Code chunk
-        start_pos = i
-        while i < len(code) and code[i] not in ('"', "'") and code[i:i+2] != '--' and not (code[i] == '[' and (i+1 < len(code) and (code[i+1] == '[' or code[i+1] == '='))):
-             i += 1
-        if start_pos < i:
-            tokens.append({'type': 'code', 'content': code[start_pos:i]})
-            
-    # 2. Process code tokens
-    processed_tokens = []
-    kw_all = ['local', 'function', 'if', 'while', 'for', 'repeat', 'do', 'then', 'else', 'elseif', 'end', 'until', 'return', 'not', 'and', 'or', 'nil', 'true', 'false', 'in']
+
+        # Code chunk: always consume at least one character so an unclosed '[[' cannot stall
+        m = CODE_END_RE.search(code, i + 1)
+        j = m.start() if m else n
+        yield 'code', code[i:j]
+        i = j
+
+def beautify_lua(code):
+    """
+    Robust Lua beautifier with minified code support and string protection.
+    """
+    # 1. Tokenize to protect strings and comments
+    return beautify_chunks(tokenize(code))
+
+def format_code(content):
+    """Spacing and line splitting for one run of code between strings and comments; needs no other context."""
+    # Operator spacing
+    content = content.replace('...', ' ___DOT3___ ')
+    content = content.replace('==', ' ___EQ___ ')
+    content = content.replace('~=', ' ___NE___ ')
+    content = content.replace('<=', ' ___LE___ ')
+    content = content.replace('>=', ' ___GE___ ')
+    content = content.replace('..', ' ___DOT2___ ')
+    for op in "=+-*/%^#<>":
+        content = content.replace(op, f" {op} ")
+    content = content.replace(' ___DOT3___ ', ' ... ')
+    content = content.replace(' ___DOT2___ ', ' .. ')
+    content = content.replace(' ___EQ___ ', ' == ')
+    content = content.replace(' ___NE___ ', ' ~= ')
+    content = content.replace(' ___LE___ ', ' <= ')
+    content = content.replace(' ___GE___ ', ' >= ')
     
-    for tok in tokens:
-        if tok['type'] == 'code':
-            content = tok['content']
-            # Operator spacing
-            content = content.replace('...', ' ___DOT3___ ')
-            content = content.replace('==', ' ___EQ___ ')
-            content = content.replace('~=', ' ___NE___ ')
-            content = content.replace('<=', ' ___LE___ ')
-            content = content.replace('>=', ' ___GE___ ')
-            content = content.replace('..', ' ___DOT2___ ')
-            for op in "=+-*/%^#<>":
-                content = content.replace(op, f" {op} ")
-            content = content.replace(' ___DOT3___ ', ' ... ')
-            content = content.replace(' ___DOT2___ ', ' .. ')
-            content = content.replace(' ___EQ___ ', ' == ')
-            content = content.replace(' ___NE___ ', ' ~= ')
-            content = content.replace(' ___LE___ ', ' <= ')
-            content = content.replace(' ___GE___ ', ' >= ')
-            
-            # Decimal and field normalization
-            content = re.sub(r'([a-zA-Z0-9_])\s*\.\s*([a-zA-Z_])', r'\1.\2', content)
-            content = re.sub(r'(\d)\s*\.\s*(\d)', r'\1.\2', content)
-            content = content.replace(',', ', ')
-            
-            # Fused expansion
-            content = expand_fused(content)
-            
-            # Minified split directives
-            split_starts = ['local', 'if', 'while', 'for', 'repeat', 'return', 'function', 'end', 'until']
-            for kw in split_starts:
-                content = re.sub(r'\s*\b(' + kw + r')\b', r'\n\1', content)
-            
-            split_middles = ['then', 'do', 'else', 'elseif']
-            for kw in split_middles:
-                content = re.sub(r'\b(' + kw + r')\b\s*', r'\1\n', content)
-                
-            content = content.replace('local\nfunction', 'local function')
-            content = content.replace(';', ';\n')
-            
-            # Clean spaces
-            content = re.sub(r' +', ' ', content)
-            processed_tokens.append(content)
-        else:
-            processed_tokens.append(tok['content'])
-            
-    # 3. Assemble and Indent
-    full_text = "".join(processed_tokens)
-    lines = full_text.splitlines()
+    # Decimal and field normalization
+    content = re.sub(r'([a-zA-Z0-9_])\s*\.\s*([a-zA-Z_])', r'\1.\2', content)
+    content = re.sub(r'(\d)\s*\.\s*(\d)', r'\1.\2', content)
+    content = content.replace(',', ', ')
+    
+    # Fused expansion
+    content = expand_fused(content)
+    
+    # Minified split directives
+    content = SPLIT_STARTS_RE.sub(r'\n\1', content)
+    content = SPLIT_MIDDLES_RE.sub(r'\1\n', content)
+
+    content = content.replace('local\nfunction', 'local function')
+    content = content.replace(';', ';\n')
     
-    indented = []
+    # Clean spaces
+    return re.sub(r' +', ' ', content)
+
+def split_lines(pieces):
+    """
+    Yields the lines of the concatenated text pieces, line breaks included, without building
+    the text. A break split across two pieces ("\r" + "\n") yields an extra blank line.
+    """
+    partial = []
+    for piece in pieces:
+        lines = piece.splitlines(True)
+        if not lines: continue
+        last = lines.pop()
+        if lines:
+            partial.append(lines[0])
+            yield ''.join(partial)
+            yield from lines[1:]
+            partial = []
+        if last.splitlines()[0] == last: partial.append(last)  # no line break yet
+        else:
+            partial.append(last)
+            yield ''.join(partial)
+            partial = []
+    if partial: yield ''.join(partial)
+
+def indent_lines(lines):
+    """Re-indents formatted lines from their block keywords, yielding each non-blank line."""
     level = 0
     step = "    "
     
@@ -148,7 +200,7 @@ def beautify_lua(code):
              if not (clean.startswith('do') and any(x in clean for x in ['while', 'for'])):
                 level = max(0, level - 1)
         
-        indented.append(step * level + clean)
+        yield step * level + clean
         
         # Indent increasing keywords
         if any(clean.endswith(kw) for kw in ['do', 'then', 'else', 'elseif', '{']):
@@ -156,7 +208,94 @@ def beautify_lua(code):
         elif clean.startswith('function') and not clean.endswith('end'):
              level += 1
 
-    return "\n".join(indented)
+def iter_lines(tokens, pool=None, fmt=format_code):
+    """
+    Formats pre-tokenized ('code' | 'string' | 'comment', text) chunks, e.g. TokenStream.chunks(),
+    lazily: output lines are yielded as the chunks are consumed, so no full copy of the text is built.
+    With a multiprocessing pool the code runs are formatted on its workers; the output is the same.
+    Without one, fmt formats each run, e.g. a memoizing wrapper of format_code.
+    """
+    return indent_lines(split_lines(_formatted(tokens, pool, fmt)))
+
+def _formatted(tokens, pool, fmt):
+    """The chunks as text pieces, code runs formatted; any other chunk's content passes through."""
+    if pool is None: return (fmt(content) if kind == 'code' else content for kind, content in tokens)
+    tokens = list(tokens)
+    formatted = pool.imap(format_code, [content for kind, content in tokens if kind == 'code'], chunksize=256)
+    return (next(formatted) if kind == 'code' else content for kind, content in tokens)
+
+def _marked_lines(pieces):
+    """
+    split_lines() over text pieces interleaved with marks (any other object). Yields
+    (line, marks), with the (offset in line, mark) of every mark before the line's last character.
+    """
+    found = deque()
+
+    def text():
+        pos = 0
+        for piece in pieces:
+            if isinstance(piece, str):
+                pos += len(piece)
+                yield piece
+            else: found.append((pos, piece))
+
+    start = 0
+    for line in split_lines(text()):
+        end = start + len(line)
+        marks = []
+        while found and found[0][0] < end:
+            pos, mark = found.popleft()
+            marks.append((pos - start, mark))
+        yield line, marks
+        start = end
+    if found: yield '', [(0, mark) for _, mark in found]
+
+def iter_marked(tokens, pool=None, fmt=format_code):
+    """
+    iter_lines() joined with newlines, for chunks that also hold ('mark', key) entries, e.g.
+    TokenStream.chunks(marks). Yields (key, text) pieces, key being that of the last mark before
+    the text (None before the first). A mark with a key binds to the next non-blank character
+    and one with None to the previous one, so a region never starts or ends with whitespace.
+    """
+    tokens = ((kind, (content,) if kind == 'mark' else content) for kind, content in tokens)
+    queue, carried = deque(), []
+
+    def lines():
+        nonlocal carried
+        for line, marks in _marked_lines(_formatted(tokens, pool, fmt)):
+            clean = line.strip()
+            lead = len(line) - len(line.lstrip())
+            # Mark columns in the stripped line, which indent_lines() re-indents
+            cols = carried + [(min(max(pos - lead, 0), len(clean)), mark[0]) for pos, mark in marks]
+            if not clean:
+                carried = [(0, key) for _, key in cols]
+                continue
+            # A key with only blanks after it on its line binds to the next line
+            cut = next((j for j, (col, key) in enumerate(cols) if col == len(clean) and key is not None), len(cols))
+            carried = [(0, key) for _, key in cols[cut:]]
+            queue.append(cols[:cut])
+            yield line
+
+    key = None
+    for n, out in enumerate(indent_lines(lines())):
+        cols = queue.popleft()
+        j = 0
+        # A None with only blanks before it on its line binds to the end of the previous line
+        while j < len(cols) and cols[j] == (0, None):
+            key = None
+            j += 1
+        if n: yield key, "\n"
+        indent, pos = len(out) - len(out.lstrip()), 0
+        for col, k in cols[j:]:
+            if indent + col > pos:
+                yield key, out[pos:indent + col]
+                pos = indent + col
+            key = k
+        if pos < len(out): yield key, out[pos:]
+
+def beautify_chunks(tokens, pool=None):
+    """Formats pre-tokenized chunks into one string; see iter_lines()."""
+    return "\n".join(iter_lines(tokens, pool))
 
 if __name__ == "__main__":
     import sys
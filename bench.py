@@ -0,0 +1,295 @@
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+import unvm
+import backends
+import hex_tool
+import beautifier
+import simplify_math
+from cache import tool_fingerprint
+
+SCHEMA_VERSION = 1
+STAGES = ('simplify_math', 'simplify_math_in_string', 'detect', 'lua_vm_decode', 'lua_vm_decode_all',
+          'beautify_lua', 'expand_fused', 'hex_reverse_search', 'deobfuscate')
+DEFAULT_SIZES = '1K,10K,100K,1M'
+WORDS = ['print', 'game', 'Players', 'LocalPlayer', 'Character', 'Humanoid', 'WalkSpeed', 'gmatch',
+         'concat', 'unpack', 'random', 'HttpGet', 'loadstring', 'You Are Lost!', 'Workspace', 'Heartbeat']
+
+def parse_size(text):
+    """'1K' / '10M' / '2048' -> bytes."""
+    text = text.strip().upper()
+    mult = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}.get(text[-1:], 1)
+    return int(float(text.rstrip('KMG')) * mult)
+
+class ScriptGenerator:
+    """
+    Builds synthetic XHider-style scripts with the same shape unvm.deobfuscate expects:
+    XOR helper, Q-table keys, hex pool, decoder `function K(r) ... if not N[r]` and N[K(offset)] calls.
+      depth   -- nesting depth of the arithmetic that hides every numeric constant
+      calls   -- number of K(<offset>) call sites
+      strings -- number of strings in the hex pool
+      minify  -- 0: one statement per line, spaced; 1: one per line, tight; 2: single line, tight
+    """
+
+    def __init__(self, depth=6, calls=None, strings=256, minify=2, seed=0):
+        self.depth, self.calls, self.strings, self.minify = depth, calls, strings, minify
+        self.rng = random.Random(seed)
+
+    # -- constants --
+
+    def const(self, n, depth=None):
+        """Token list of an arithmetic expression that evaluates to n."""
+        depth = self.depth if depth is None else depth
+        if depth <= 0: return ['(', '-' + str(-n), ')'] if n < 0 else [str(n)]
+        a = self.rng.randint(-10 ** 6, 10 ** 6)
+        # Unbalanced trees: one side carries the full depth, the other stays shallow
+        deep, shallow = depth - 1, self.rng.choice((0, 0, depth // 2))
+        if self.rng.random() < 0.5:
+            left, right, op = (a, n - a, '+')
+        else:
+            left, right, op = (a, a - n, '-')
+        if self.rng.random() < 0.5: dl, dr = deep, shallow
+        else: dl, dr = shallow, deep
+        return ['('] + self.const(left, dl) + [op] + self.const(right, dr) + [')']
+
+    # -- pool --
+
+    def pool(self, keys):
+        """Encodes the string pool; returns (hex, [record offsets])."""
+        raw = bytearray()
+        offsets = []
+        for i in range(max(self.strings, 1)):
+            s = self.rng.choice(WORDS) + (str(i) if i >= len(WORDS) else '')
+            rec = len(s).to_bytes(4, 'little') + s.encode('latin-1')
+            offsets.append(len(raw))
+            raw += bytes(b ^ keys[j % 4] for j, b in enumerate(rec))
+        while len(raw) < 100: raw += b'\0'  # unvm needs a 200+ digit literal
+        return raw.hex().upper(), offsets
+
+    # -- layout --
+
+    def _join(self, toks):
+        if self.minify == 0: return ' '.join(toks)
+        out = toks[0]
+        for t in toks[1:]:
+            if (out[-1].isalnum() or out[-1] == '_') and (t[0].isalnum() or t[0] == '_'): out += ' '
+            out += t
+        return out
+
+    def _emit(self, stmts, indent):
+        sep = ' ' if self.minify == 2 else '\n'
+        pad = '    ' * indent if self.minify == 0 else ''
+        return sep.join(pad + self._join(s) for s in stmts)
+
+    def prologue(self, keys, hex_pool):
+        c = self.const
+        return [
+            ['local', 'N', ',', 'K', 'do'],
+            ['local', 'r', '=', 'math', '.', 'floor'],
+            ['local', 'j', '=', 'string', '.', 'char'],
+            ['local', 'function', 'v', '(', 'K', ',', 'N', ')'],
+            ['local', 'j', '='] + c(0),
+            ['for', 'n', '='] + c(0) + [','] + c(7) + [','] + c(1) + ['do'],
+            ['local', 'v', '=', 'K', '/'] + c(2) + ['+', 'N', '/'] + c(2),
+            ['if', 'v', '~=', 'r', '(', 'v', ')', 'then', 'j', '=', 'j', '+'] + c(2) + ['^', 'n', 'end'],
+            ['K', '=', 'r', '(', 'K', '/'] + c(2) + [')', 'N', '=', 'r', '(', 'N', '/'] + c(2) + [')'],
+            ['end', 'return', 'j', 'end'],
+            ['local', 'i', '=', '{'] + c(keys[0]) + [','] + c(keys[1]) + [';'] + c(keys[2]) + [','] + c(keys[3]) + ['}'],
+            ['local', 'H', '=', 'string', '.', 'sub'],
+            ['local', 'function', 'y', '(', 'r', ')', 'local', 'K', '=', '{', '}'],
+            ['for', 'N', '='] + c(1) + [',', '#', 'r', ','] + c(2) + ['do'],
+            ['local', 'j', '=', 'H', '(', 'r', ',', 'N', ',', 'N', '+'] + c(1) + [')'],
+            ['K', '[', '#', 'K', '+'] + c(1) + [']', '=', 'tonumber', '(', 'j', ','] + c(16) + [')'],
+            ['end', 'return', 'K', 'end'],
+            ['local', 'b', '=', '"' + hex_pool + '"'],
+            ['local', 'q', '=', 'y', '(', 'b', ')', 'local', 'a', '=', '{', '}'],
+            ['N', '=', 'setmetatable', '(', '{', '}', ',', '{', '__index', '=', 'a', ',', '__metatable', '=', 'nil', '}', ')'],
+            ['function', 'K', '(', 'r', ')', 'local', 'N', '=', 'a', 'if', 'not', 'N', '[', 'r', ']', 'then'],
+            ['local', 'K', '=', 'r', '+'] + c(1),
+            ['local', 'n', '=', 'v', '(', 'q', '[', 'K', ']', ',', 'i', '[', '1', ']', ')', '+', 'v', '(', 'q', '[', 'K', '+', '1', ']', ',', 'i', '[', '2', ']', ')', '*'] + c(256)
+            + ['+', 'v', '(', 'q', '[', 'K', '+', '2', ']', ',', 'i', '[', '3', ']', ')', '*'] + c(65536)
+            + ['+', 'v', '(', 'q', '[', 'K', '+', '3', ']', ',', 'i', '[', '4', ']', ')', '*'] + c(16777216),
+            ['K', '=', 'K', '+'] + c(4) + ['local', 'H', '=', '{', '}'],
+            ['for', 'r', '='] + c(1) + [',', 'n', 'do', 'local', 'N', '=', '(', 'r', '-', '1', ')', '%', '4', '+', '1',
+                                         'H', '[', 'r', ']', '=', 'j', '(', 'v', '(', 'q', '[', '(', 'K', '+', 'r', ')', '-', '1', ']', ',', 'i', '[', 'N', ']', ')', ')', 'end'],
+            ['N', '[', 'r', ']', '=', 'table', '.', 'concat', '(', 'H', ')', 'end', 'return', 'r', 'end', 'end'],
+        ]
+
+    def statement(self, i, offsets, with_call):
+        c, rng = self.const, self.rng
+        var = f"v{i}"
+        if with_call:
+            call = ['N', '[', 'K', '(', str(rng.choice(offsets)), ')', ']']
+            return rng.choice([
+                ['local', var, '='] + call,
+                ['print', '('] + call + [',', var, ')'],
+                ['_G', '['] + call + [']', '='] + c(rng.randint(-999, 999)),
+            ])
+        return rng.choice([
+            ['local', var, '='] + c(rng.randint(-10 ** 5, 10 ** 5)),
+            ['if', var, '>'] + c(rng.randint(0, 99)) + ['then', var, '=', var, '+'] + c(rng.randint(1, 9)) + ['end'],
+            ['for', 'x', '='] + c(1) + [','] + c(rng.randint(2, 9)) + ['do', var, '=', var, '*'] + c(2) + ['end'],
+        ])
+
+    def generate(self, size):
+        """Returns a script of roughly `size` bytes."""
+        keys = [self.rng.randint(1, 255) for _ in range(4)]
+        hex_pool, offsets = self.pool(keys)
+        head = "--// This file was created by XHider (synthetic benchmark input)\n\nreturn(function(...)"
+        head += (' ' if self.minify == 2 else '\n') + self._emit(self.prologue(keys, hex_pool), 1)
+        tail = (' ' if self.minify == 2 else '\n') + "end)(...)\n"
+        calls = self.calls if self.calls is not None else max(1, size // 200)
+        parts, total, i = [], len(head) + len(tail), 0
+        # Spread call sites evenly over the body, then fill up to the size with plain statements
+        while total < size or calls > 0:
+            with_call = calls > 0 and (total >= size or self.rng.random() < 0.5)
+            if with_call: calls -= 1
+            s = self._emit([self.statement(i, offsets, with_call)], 1)
+            parts.append(s)
+            total += len(s) + 1
+            i += 1
+        sep = ' ' if self.minify == 2 else '\n'
+        return head + sep + sep.join(parts) + tail
+
+def _measure(fn, repeat, memory):
+    runs = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        runs.append(round(time.perf_counter() - t, 6))
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'seconds': min(runs), 'runs': runs, 'peak_bytes': peak}
+
+def stage_inputs(script):
+    """Precomputes what each public stage consumes, outside the timed region."""
+    stream = unvm.TokenStream(unvm.simplify_math(script))
+    sig = stream.significant()
+    kinds = [stream.kind(i) for i in sig]
+    vals = stream.values(sig, clip=unvm.CLIP)
+    pool = backends.find_hex_pool(stream, sig)
+    keys = backends.find_keys(kinds, vals)
+    offsets = sorted(set(int(vals[p + 2]) for p in unvm.find_call_sites(kinds, vals).get('K', [])))
+    return stream, pool, keys, offsets
+
+def run_benchmarks(sizes, stages=STAGES, repeat=3, memory=True, gen_opts=None, log=None):
+    log = log or (lambda msg: None)
+    gen_opts = gen_opts or {}
+    results = []
+    for size in sizes:
+        script = ScriptGenerator(**gen_opts).generate(size)
+        stream, pool, keys, offsets = stage_inputs(script)
+        fns = {
+            'simplify_math': lambda: unvm.simplify_math(script),
+            'simplify_math_in_string': lambda: simplify_math.simplify_math_in_string(script),
+            'detect': lambda: backends.detect(stream),
+            'lua_vm_decode': lambda: [backends.lua_vm_decode(pool, keys, o) for o in offsets],
+            'lua_vm_decode_all': lambda: backends.lua_vm_decode_all(pool, keys, offsets),
+            'beautify_lua': lambda: beautifier.beautify_lua(script),
+            'expand_fused': lambda: beautifier.expand_fused(script),
+            'hex_reverse_search': lambda: hex_tool.hex_reverse_search(script),
+            'deobfuscate': lambda: unvm.deobfuscate(script),
+        }
+        for stage in stages:
+            log(f"{size:>12} bytes  {stage}...")
+            r = _measure(fns[stage], repeat, memory)
+            r.update(size=size, input_bytes=len(script), stage=stage)
+            results.append(r)
+    return results
+
+def report(results, params):
+    return {
+        'schema': SCHEMA_VERSION,
+        'tool': tool_fingerprint(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'params': params,
+        'results': results,
+    }
+
+def compare(old, new, threshold=0.10, memory_threshold=0.10):
+    """
+    Yields (size, stage, metric, old, new, ratio, regressed) for stages present in both reports:
+    'seconds' regresses past threshold, and 'peak_bytes', when both runs traced memory, past memory_threshold.
+    """
+    base = {(r['size'], r['stage']): r for r in old['results']}
+    for r in new['results']:
+        o = base.get((r['size'], r['stage']))
+        if not o: continue
+        for metric, limit in (('seconds', threshold), ('peak_bytes', memory_threshold)):
+            if o.get(metric) is None or r.get(metric) is None: continue
+            ratio = r[metric] / o[metric] if o[metric] else float('inf')
+            yield r['size'], r['stage'], metric, o[metric], r[metric], ratio, ratio > 1 + limit
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the de-obfuscation stages on synthetic XHider scripts.")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    def gen_args(p):
+        p.add_argument('--depth', type=int, default=6, help="constant arithmetic nesting depth")
+        p.add_argument('--calls', type=int, default=None, help="K(<offset>) call sites (default: size/200)")
+        p.add_argument('--strings', type=int, default=256, help="strings in the hex pool")
+        p.add_argument('--minify', type=int, default=2, choices=(0, 1, 2), help="minification degree")
+        p.add_argument('--seed', type=int, default=0)
+
+    run = sub.add_parser('run', help="time and memory-profile every stage")
+    run.add_argument('--sizes', default=DEFAULT_SIZES, help=f"comma-separated sizes (default: {DEFAULT_SIZES})")
+    run.add_argument('--stages', default=','.join(STAGES))
+    run.add_argument('-r', '--repeat', type=int, default=3)
+    run.add_argument('--no-memory', action='store_true', help="skip the tracemalloc run")
+    run.add_argument('-o', '--output', default=None, help="JSON results file (default: stdout)")
+    gen_args(run)
+
+    gen = sub.add_parser('generate', help="write one synthetic script")
+    gen.add_argument('size')
+    gen.add_argument('output')
+    gen_args(gen)
+
+    cmp_ = sub.add_parser('compare', help="compare two result files")
+    cmp_.add_argument('old')
+    cmp_.add_argument('new')
+    cmp_.add_argument('--threshold', type=float, default=0.10, help="slowdown ratio counted as a regression")
+    cmp_.add_argument('--memory-threshold', type=float, default=0.10, help="peak memory growth ratio counted as a regression")
+
+    args = parser.parse_args()
+    if args.cmd in ('run', 'generate'):
+        gen_opts = {'depth': args.depth, 'calls': args.calls, 'strings': args.strings, 'minify': args.minify, 'seed': args.seed}
+
+    if args.cmd == 'generate':
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(ScriptGenerator(**gen_opts).generate(parse_size(args.size)))
+        return 0
+
+    if args.cmd == 'compare':
+        with open(args.old, encoding='utf-8') as f: old = json.load(f)
+        with open(args.new, encoding='utf-8') as f: new = json.load(f)
+        regressions = 0
+        for size, stage, metric, o, n, ratio, bad in compare(old, new, args.threshold, args.memory_threshold):
+            regressions += bad
+            o, n = (f"{o:>10.4f}s", f"{n:>10.4f}s") if metric == 'seconds' else (f"{o / 2**20:>9.2f}MB", f"{n / 2**20:>9.2f}MB")
+            print(f"{size:>12} {stage:<24} {o} -> {n}  x{ratio:.2f}{'  REGRESSION' if bad else ''}")
+        return 1 if regressions else 0
+
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown: parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    results = run_benchmarks(sizes, stages, args.repeat, not args.no_memory, gen_opts,
+                             log=lambda msg: print(msg, file=sys.stderr))
+    params = dict(gen_opts, sizes=sizes, repeat=args.repeat)
+    out = json.dumps(report(results, params), indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(out + "\n")
+    else: print(out)
+    return 0
+
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,113 @@
+import os
+import json
+import zlib
+import hashlib
+
+DEFAULT_DIR = os.environ.get('UNVM_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'unvm')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Eviction frees max_bytes // SLACK_FRACTION below the limit, so the next writes don't evict
+# again at once. Other processes write to the same cache, so a process also rescans it after
+# writing that many bytes itself, even when its own running total is under the limit.
+SLACK_FRACTION = 8
+
+# Sources whose behaviour determines the final output; editing any of them invalidates cached outputs
+_TOOL_SOURCES = ('unvm.py', 'backends.py', 'simplify_math.py', 'beautifier.py', 'lua_lexer.py')
+_tool_fp = None
+
+def tool_fingerprint():
+    """Hash of the pipeline sources, so cached outputs never outlive a code change."""
+    global _tool_fp
+    if _tool_fp is None:
+        h = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in _TOOL_SOURCES:
+            try:
+                with open(os.path.join(here, name), 'rb') as f: h.update(f.read())
+            except OSError: h.update(name.encode())
+        _tool_fp = h.hexdigest()[:16]
+    return _tool_fp
+
+def pool_key(hex_pool, keys, backend='xhider'):
+    """Fingerprint of a (hex pool, key table) pair, as decoded by the named backend."""
+    h = hashlib.sha256(hex_pool)
+    h.update(repr(list(keys)).encode())
+    h.update(backend.encode())
+    return h.hexdigest()
+
+def output_key(code, variant=''):
+    """Fingerprint of an input script under the current tool version and pipeline options."""
+    h = hashlib.sha256(code.encode('utf-8', 'surrogatepass'))
+    h.update(tool_fingerprint().encode())
+    h.update(variant.encode())
+    return h.hexdigest()
+
+class Cache:
+    """
+    Size-bounded on-disk LRU cache of JSON values addressed by content hash.
+    Entries live in <root>/<namespace>/<xx>/<key>; reads refresh the mtime, and
+    the oldest entries are evicted whenever a write pushes the total over max_bytes.
+    The total is scanned from disk on the first write, then kept up to date by put(),
+    so a write only walks the cache when it may have to evict.
+    """
+
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root or DEFAULT_DIR
+        self.max_bytes = max_bytes
+        self._total = None  # bytes on disk at the last scan, plus this process's writes since
+        self._written = 0  # bytes this process wrote since the last scan
+
+    def _path(self, ns, key):
+        return os.path.join(self.root, ns, key[:2], key)
+
+    def get(self, ns, key):
+        path = self._path(ns, key)
+        try:
+            with open(path, 'rb') as f: value = json.loads(zlib.decompress(f.read()))
+            os.utime(path)
+            return value
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def put(self, ns, key, value):
+        path = self._path(ns, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            data = zlib.compress(json.dumps(value).encode())
+            with open(tmp, 'wb') as f: f.write(data)
+            try: replaced = os.stat(path).st_size
+            except OSError: replaced = 0
+            os.replace(tmp, path)
+        except OSError:
+            return
+        if self._total is None: return self.evict()
+        self._total += len(data) - replaced
+        self._written += len(data)
+        if self._total > self.max_bytes or self._written > self.max_bytes // SLACK_FRACTION: self.evict()
+
+    def _entries(self):
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try: st = os.stat(path)
+                except OSError: continue
+                yield st.st_mtime, st.st_size, path
+
+    def evict(self):
+        """When the cache is over max_bytes, deletes least recently used entries until it is SLACK_FRACTION under."""
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes - self.max_bytes // SLACK_FRACTION
+            for _, size, path in sorted(entries):
+                try: os.remove(path)
+                except OSError: continue
+                total -= size
+                if total <= target: break
+        self._total, self._written = total, 0
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            try: os.remove(path)
+            except OSError: pass
+        self._total, self._written = None, 0
@@ -1,5 +1,11 @@
+import os
 import re
-import sys
+import json
+import mmap
+import math
+import argparse
+import multiprocessing
+from collections import Counter
 
 def hex_to_bytes(hex_str):
     """Converts hex string to byte array."""
@@ -13,49 +19,168 @@ def bytes_to_hex(data):
     """Converts bytes to hex string."""
     return data.hex().upper()
 
+# Bytes that count as text: printable ASCII plus tab, newline and carriage return.
+# data.translate(None, NON_PRINTABLE) keeps just those, so counting them is one C call.
+PRINTABLE = bytes(range(0x20, 0x7F)) + b'\t\n\r'
+NON_PRINTABLE = bytes(b for b in range(256) if b not in PRINTABLE)
+# XOR_TABLES[k] maps every byte b to b ^ k (same tables as backends)
+XOR_TABLES = [bytes(b ^ k for b in range(256)) for k in range(256)]
+
+def printable_ratio(data):
+    return len(data.translate(None, NON_PRINTABLE)) / len(data) if data else 0.0
+
+def entropy(data):
+    """Shannon entropy in bits per byte (0-8)."""
+    n = len(data)
+    if not n: return 0.0
+    return -sum(c / n * math.log2(c / n) for c in Counter(data).values())
+
 def hex_reverse_search(text):
     """Finds hex segments in text and shows decoded strings."""
     # Matches strings of 10+ hex characters
-    matches = re.finditer(r'["\']([0-9a-fA-F]{10,})["\']', text)
     results = []
-    for m in matches:
+    for m in re.finditer(r'["\']([0-9a-fA-F]{10,})["\']', text):
         hex_val = m.group(1)
-        data = hex_to_bytes(hex_val)
-        try:
-            decoded = data.decode('utf-8', errors='replace')
-            # Only keep if it looks like real text (mostly printable)
-            printable_ratio = sum(1 for c in decoded if c.isprintable()) / len(decoded)
-            if printable_ratio > 0.5:
-                results.append((m.start(), hex_val, decoded))
-        except:
-            pass
+        data = bytes.fromhex(hex_val[:len(hex_val) & ~1])
+        # Only keep if it looks like real text (mostly printable)
+        if printable_ratio(data) > 0.5:
+            results.append((m.start(), hex_val, data.decode('utf-8', errors='replace')))
     return results
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print("  python hex_tool.py decode <hex_file_or_string>")
-        print("  python hex_tool.py encode <string>")
-        print("  python hex_tool.py search <lua_file>")
-        sys.exit(1)
-
-    cmd = sys.argv[1].lower()
-    val = sys.argv[2] if len(sys.argv) > 2 else ""
-
-    if cmd == "decode":
-        print(hex_to_bytes(val))
-    elif cmd == "encode":
-        print(bytes_to_hex(val.encode('utf-8')))
-    elif cmd == "search":
-        try:
-            with open(val, 'r', encoding='utf-8') as f:
-                content = f.read()
-            found = hex_reverse_search(content)
-            if not found:
-                print("No clear hex-encoded ASCII strings found.")
-            for pos, h, d in found:
-                print(f"[{pos}] Hex: {h[:30]}...")
-                print(f"      Dec: {d}")
-                print("-" * 40)
-        except Exception as e:
-            print(f"Error reading file: {e}")
+# -- search mode --
+
+HEX_LITERAL_RE = re.compile(rb'["\']([0-9a-fA-F]{10,})["\']')
+SAMPLE_BYTES = 1 << 16   # bytes decoded to score one literal; bounds memory on huge pools
+MIN_POOL_DIGITS = 200    # same threshold as backends.find_hex_pool
+MAX_KEY_TRIALS = 64
+
+def _xor(data, keys):
+    out = bytearray(len(data))
+    for j in range(4): out[j::4] = data[j::4].translate(XOR_TABLES[keys[j]])
+    return out
+
+class _HexView:
+    """Byte-addressed view of a hex literal inside a mapped file; decodes only the ranges asked for."""
+
+    def __init__(self, mm, start, end):
+        self.mm, self.start, self.size = mm, start, (end - start) // 2
+
+    def __len__(self):
+        return self.size
+
+    def read(self, o, n):
+        s = self.start + 2 * o
+        return bytes.fromhex(self.mm[s:s + 2 * min(n, self.size - o)].decode('ascii'))
+
+def _walk_records(view, keys, budget):
+    """Follows the XHider record chain; returns (records, bytes covered, decoded sample)."""
+    o, records, sample = 0, 0, bytearray()
+    while o + 4 <= len(view):
+        length = int.from_bytes(_xor(view.read(o, 4), keys), 'little')
+        if o + 4 + length > len(view): break
+        if len(sample) < budget: sample += _xor(view.read(o + 4, min(length, budget - len(sample))), keys)
+        records += 1
+        o += 4 + length
+    return records, o, bytes(sample)
+
+def guess_xhider_keys(view):
+    """
+    Recovers the 4-byte XOR key of an XHider pool from its own structure.
+    Every record starts with a little-endian length under 64K, so the header's two high bytes
+    XOR to the last two keys. The first two follow from where the second header starts.
+    Returns (keys, records, coverage, printable ratio of the decoded strings) or None.
+    """
+    if len(view) < 8: return None
+    head = view.read(0, min(len(view), SAMPLE_BYTES))
+    k2, k3 = head[2], head[3]
+    best, tried, i = None, 0, head.find(bytes([k2, k3]), 6)
+    while i != -1 and tried < MAX_KEY_TRIALS:
+        length = i - 2 - 4
+        if length < 0x10000:
+            tried += 1
+            keys = [head[0] ^ (length & 0xFF), head[1] ^ (length >> 8), k2, k3]
+            records, covered, sample = _walk_records(view, keys, 4096)
+            coverage = covered / len(view)
+            if records >= 2 and coverage >= 0.9:
+                cand = (keys, records, coverage, printable_ratio(sample))
+                if not best or cand[2] * cand[3] > best[2] * best[3]: best = cand
+        i = head.find(bytes([k2, k3]), i + 1)
+    return best
+
+def score_literal(mm, start, end):
+    """Scores one hex literal found at [start, end) of a mapped file; None if it is not worth reporting."""
+    view = _HexView(mm, start, end - (end - start) % 2)
+    data = view.read(0, SAMPLE_BYTES)
+    ratio, ent = printable_ratio(data), entropy(data)
+    rec = {'offset': start, 'end': end, 'bytes': len(view), 'printable': round(ratio, 3), 'entropy': round(ent, 3)}
+    if end - start >= MIN_POOL_DIGITS:
+        guess = guess_xhider_keys(view)
+        if guess:
+            keys, records, coverage, text = guess
+            rec.update(kind='xhider', keys=keys, records=records, score=round(1 + coverage * text, 3),
+                       preview=_walk_records(view, keys, 60)[2].decode('latin-1'))
+            return rec
+    if ratio <= 0.5: return None
+    score = ratio * min(1.0, len(view) / 32) * (0.5 if ent > 7 else 1.0)
+    rec.update(kind='text', score=round(score, 3), preview=data[:60].decode('utf-8', errors='replace'))
+    return rec
+
+def search_file(path):
+    """Ranked candidate records for one file, scanned through mmap. Never raises."""
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0: return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                found = []
+                for m in HEX_LITERAL_RE.finditer(mm):
+                    rec = score_literal(mm, *m.span(1))
+                    if rec: found.append(dict(rec, file=os.path.abspath(path)))
+                return found
+    except (OSError, ValueError):
+        return []
+
+def search(paths, workers=None):
+    """Searches files and directory trees (all .lua files) on a process pool; best candidates first."""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                files.extend(os.path.join(root, n) for n in names if n.endswith('.lua') and not n.endswith('.unvm.lua'))
+        else: files.append(p)
+    files.sort()
+    if len(files) > 1 and workers != 1:
+        with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+            found = [r for recs in pool.imap_unordered(search_file, files, chunksize=4) for r in recs]
+    else:
+        found = [r for f in files for r in search_file(f)]
+    found.sort(key=lambda r: (-r['score'], r['file'], r['offset']))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Hex helpers and hex-pool discovery.")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('decode', help="hex to bytes").add_argument('value')
+    sub.add_parser('encode', help="string to hex").add_argument('value')
+    p = sub.add_parser('search', help="rank hex literals and XHider pools in files or directories")
+    p.add_argument('paths', nargs='+')
+    p.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    p.add_argument('-n', '--top', type=int, default=20, help="candidates to print (0 for all)")
+    p.add_argument('--json', action='store_true', help="JSON lines, usable as `unvm.py --hints`")
+    args = parser.parse_args()
+
+    if args.cmd == 'decode': print(hex_to_bytes(args.value)); return
+    if args.cmd == 'encode': print(bytes_to_hex(args.value.encode('utf-8'))); return
+    found = search(args.paths, args.workers)
+    if args.top: found = found[:args.top]
+    if args.json:
+        for rec in found: print(json.dumps(rec))
+        return
+    if not found: print("No clear hex-encoded strings or pools found.")
+    for r in found:
+        print(f"[{r['score']:.3f}] {r['kind']:6} {r['file']}:{r['offset']} ({r['bytes']} bytes, "
+              f"printable {r['printable']:.0%}, entropy {r['entropy']:.2f})")
+        if r['kind'] == 'xhider': print(f"      Keys: {r['keys']}, {r['records']} records")
+        print(f"      Dec: {r['preview']!r}")
+        print("-" * 40)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,65 @@
+import os
+import time
+
+from beautifier import format_code
+
+class Session:
+    """
+    State one watched script keeps between pipeline runs, so a run only redoes what its
+    input changed: Pass 1 reuses the folded chunks whose text and enclosing scope are
+    unchanged, Pass 3 the strings already decoded from the same pool and keys, and Pass 5
+    the formatted code runs. Every table only keeps what the latest run used.
+    """
+
+    def __init__(self):
+        self.chunks = {}     # Pass 1: chunk reports, see parallel._MemoPool
+        self.pools = {}      # Pass 3: pool_key -> {offset: string}
+        self.formatted = {}  # Pass 5: code run -> format_code(run)
+        self.stats = {}      # counters of the latest run
+
+    def formatter(self):
+        """format_code through the runs the previous run formatted; the runs of this one replace them."""
+        previous, current = self.formatted, {}
+        self.formatted = current
+        stats = self.stats
+        stats.update(runs=0, runs_reused=0)
+
+        def fmt(content):
+            out = current.get(content)
+            if out is None:
+                out = previous.get(content)
+                if out is None: out = format_code(content)
+                else: stats['runs_reused'] += 1
+                current[content] = out
+            else:
+                stats['runs_reused'] += 1
+            stats['runs'] += 1
+            return out
+        return fmt
+
+def watch(path, run, interval=0.5, log=print):
+    """
+    Calls run(code) with the content of path now and after every change, until interrupted.
+    The modification time is polled every `interval` seconds; a save that leaves the text
+    as it was does not trigger a run. A file that cannot be read (mid-save, locked, or not
+    yet valid UTF-8) is logged once and read again on every poll until it can be.
+    """
+    last_mtime, last_code, failed = None, None, False
+    try:
+        while True:
+            try: mtime = os.stat(path).st_mtime_ns
+            except OSError: mtime = last_mtime  # mid-save, or removed: keep waiting
+            if mtime != last_mtime:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f: code = f.read()
+                except (OSError, UnicodeDecodeError) as e:
+                    if not failed: log(f"Cannot read {path}, retrying: {e}")
+                    failed = True
+                else:
+                    last_mtime, failed = mtime, False
+                    if code != last_code:
+                        last_code = code
+                        run(code)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        log("Stopped watching.")
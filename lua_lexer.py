@@ -0,0 +1,251 @@
+import re
+from array import array
+from itertools import compress
+
+KEYWORDS = frozenset([
+    'and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', 'function', 'goto', 'if', 'in',
+    'local', 'nil', 'not', 'or', 'repeat', 'return', 'then', 'true', 'until', 'while',
+])
+
+# One master pattern for the whole Lua lexical grammar. Alternatives are tried in order, so
+# comments win over the '-' operator and long brackets win over '['. Quoted strings use the
+# unrolled form, which repeats only per escape, so huge literals need no backtracking state.
+TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<comment>--(?:\[(?P<ceq>=*)\[.*?\](?P=ceq)\]|[^\n]*))
+  | (?P<string>"[^"\\\n]*(?:\\.[^"\\\n]*)*"|'[^'\\\n]*(?:\\.[^'\\\n]*)*'|\[(?P<seq>=*)\[.*?\](?P=seq)\])
+  | (?P<number>0[xX][0-9a-fA-F]*(?:\.[0-9a-fA-F]*)?(?:[pP][+-]?\d+)?|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op>\.\.\.|\.\.|==|~=|<=|>=|//|<<|>>|::|[-+*/%^#&~|<>=(){}\[\];:,.])
+  | (?P<other>.)
+''', re.S | re.X)
+
+def tokenize(text, skip=('ws', 'comment'), pos=0):
+    """Yields (kind, start, end) for every Lua token in text from pos on, one regex match per token."""
+    kw = KEYWORDS
+    for m in TOKEN_RE.finditer(text, pos):
+        kind = m.lastgroup
+        if kind in skip: continue
+        s, e = m.span()
+        if kind == 'name' and text[s:e] in kw: kind = 'keyword'
+        yield kind, s, e
+
+# String values are Lua byte strings held as latin-1 text: one character per byte.
+SIMPLE_ESCAPES = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+                  '\\': '\\', '"': '"', "'": "'"}
+ESCAPE_RE = re.compile(r'\\(?:x(?P<hex>[0-9a-fA-F]{2})|(?P<dec>\d{1,3})|u\{(?P<uni>[0-9a-fA-F]{1,6})\}'
+                       r'|(?P<z>z\s*)|(?P<nl>\r\n?|\n\r?)|(?P<ch>.))', re.S)
+LONG_OPEN_RE = re.compile(r'\[(=*)\[')
+# Every character that cannot appear verbatim in a double-quoted literal, mapped to its escape:
+# control bytes, and bytes outside valid UTF-8 (which 'surrogateescape' decodes to U+DC80-U+DCFF)
+QUOTE_TABLE = {i: f'\\{i:03d}' for i in list(range(32)) + [127]}
+QUOTE_TABLE.update({0xDC00 + i: f'\\{i:03d}' for i in range(128, 256)})
+QUOTE_TABLE.update({ord('\\'): '\\\\', ord('"'): '\\"', ord('\n'): '\\n', ord('\r'): '\\r', ord('\t'): '\\t'})
+
+def _as_bytes(text):
+    """Source text to Lua bytes: non-ASCII characters become their UTF-8 encoding."""
+    return text if text.isascii() else text.encode('utf-8', 'surrogatepass').decode('latin-1')
+
+def parse_string(tok):
+    """Byte value of a string literal token, or None if it is malformed."""
+    m = LONG_OPEN_RE.match(tok)
+    if m:
+        body = tok[m.end():len(tok) - m.end()]
+        if body[:2] in ('\r\n', '\n\r'): body = body[2:]
+        elif body[:1] in ('\r', '\n'): body = body[1:]
+        return _as_bytes(re.sub(r'\r\n|\n\r|\r', '\n', body))
+    body = tok[1:-1]
+    out, last = [], 0
+    for m in ESCAPE_RE.finditer(body):
+        out.append(_as_bytes(body[last:m.start()]))
+        last = m.end()
+        kind = m.lastgroup
+        if kind == 'hex': out.append(chr(int(m.group('hex'), 16)))
+        elif kind == 'dec':
+            if int(m.group('dec')) > 255: return None
+            out.append(chr(int(m.group('dec'))))
+        elif kind == 'uni':
+            if int(m.group('uni'), 16) > 0x10FFFF: return None
+            out.append(_as_bytes(chr(int(m.group('uni'), 16))))
+        elif kind == 'nl': out.append('\n')
+        elif kind == 'ch':
+            if m.group('ch') not in SIMPLE_ESCAPES: return None
+            out.append(SIMPLE_ESCAPES[m.group('ch')])
+    out.append(_as_bytes(body[last:]))
+    return ''.join(out)
+
+def quote_string(value):
+    """
+    Double-quoted literal for a byte string. Bytes forming valid UTF-8 are kept as text, so the
+    literal reads as written once saved as UTF-8; control bytes and invalid sequences use
+    fixed-width \\ddd escapes.
+    """
+    if not value.isascii(): value = value.encode('latin-1').decode('utf-8', 'surrogateescape')
+    return '"' + value.translate(QUOTE_TABLE) + '"'
+
+KINDS = ('ws', 'comment', 'string', 'number', 'name', 'keyword', 'op', 'other')
+KIND_CODE = {k: i for i, k in enumerate(KINDS)}
+TRIVIA = (KIND_CODE['ws'], KIND_CODE['comment'])
+# Maps a kind code to 1 for significant tokens and 0 for trivia
+SIGNIFICANT = bytes(0 if k in TRIVIA else 1 for k in range(256))
+
+def offset_code(source):
+    """Array typecode for token offsets into source: 4-byte ints, 8-byte only past 2 GiB."""
+    return 'i' if len(source) < 2**31 else 'q'
+
+class TokenStream:
+    """
+    Compact token stream shared by every pass of the pipeline.
+    Tokens are parallel arrays of kind code, start and end offsets into `source`; text
+    synthesized by a pass lives in `extra` and is referenced by a negative start.
+    Passes splice edits into the arrays; the full text is only rebuilt by text().
+    """
+    __slots__ = ('source', 'kinds', 'starts', 'ends', 'extra')
+
+    def __init__(self, source, toks=None):
+        self.source = source
+        self.kinds, self.starts, self.ends = array('B'), array(offset_code(source)), array(offset_code(source))
+        self.extra = []
+        # Straight into the arrays: a list of token tuples would take ~10x their memory
+        kind, start, end, code = self.kinds.append, self.starts.append, self.ends.append, KIND_CODE
+        for k, s, e in tokenize(source, skip=()) if toks is None else toks:
+            kind(code[k])
+            start(s)
+            end(e)
+
+    @classmethod
+    def from_span(cls, source, start, end):
+        """
+        Stream of the tokens in source[start:end], offsets still relative to source.
+        start must be a token boundary; returns None when a token runs past end, i.e. end is not one.
+        """
+        straddled = []
+
+        def toks():
+            for tok in tokenize(source, skip=(), pos=start):
+                if tok[1] >= end: return
+                if tok[2] > end:
+                    straddled.append(tok)
+                    return
+                yield tok
+
+        stream = cls(source, toks())
+        return None if straddled else stream
+
+    @classmethod
+    def concat(cls, source, parts):
+        """One stream from the (kinds, starts, ends) arrays of consecutive unspliced streams over source."""
+        stream = cls(source, [])
+        for kinds, starts, ends in parts:
+            stream.kinds.extend(kinds)
+            stream.starts.extend(starts)
+            stream.ends.extend(ends)
+        return stream
+
+    def arrays(self):
+        return self.kinds, self.starts, self.ends
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def kind(self, i):
+        return KINDS[self.kinds[i]]
+
+    def value(self, i):
+        s = self.starts[i]
+        return self.source[s:self.ends[i]] if s >= 0 else self.extra[-s - 1]
+
+    def span(self, i):
+        """(text, start, end) locating token i, so it can be matched in place without slicing."""
+        s = self.starts[i]
+        if s >= 0: return self.source, s, self.ends[i]
+        text = self.extra[-s - 1]
+        return text, 0, len(text)
+
+    def values(self, indices, clip=None):
+        """Texts of the given tokens; with clip, string literals are cut to their first `clip` characters."""
+        if clip is None: return [self.value(i) for i in indices]
+        string, kinds = KIND_CODE['string'], self.kinds
+        return [self.value(i) if kinds[i] != string else self.value_prefix(i, clip) for i in indices]
+
+    def value_prefix(self, i, n):
+        """The first n characters of token i, copying no more than that."""
+        s = self.starts[i]
+        return self.source[s:min(self.ends[i], s + n)] if s >= 0 else self.extra[-s - 1][:n]
+
+    def significant(self):
+        """Indices of all non-whitespace, non-comment tokens, as an array."""
+        return array(self.starts.typecode, self.iter_significant())
+
+    def iter_significant(self):
+        """significant() as an iterator, for one pass that needs no random access."""
+        return compress(range(len(self.kinds)), self.kinds.tobytes().translate(SIGNIFICANT))
+
+    def splice(self, edits):
+        """
+        Replaces token ranges in one linear rebuild. edits is an iterable of
+        (i, j, text): tokens [i, j) become the tokens of `text`. Ranges must not overlap.
+        Each distinct text is lexed and stored once, however many ranges it replaces.
+        """
+        edits = sorted(edits)
+        if not edits: return
+        kinds, starts, ends = array('B'), array(self.starts.typecode), array(self.ends.typecode)
+        last = 0
+        lexed = {}  # text -> its (kind code, start) tokens; identical edits share their `extra` entries
+        for i, j, text in edits:
+            kinds.extend(self.kinds[last:i])
+            starts.extend(self.starts[last:i])
+            ends.extend(self.ends[last:i])
+            toks = lexed.get(text)
+            if toks is None:
+                toks = lexed[text] = []
+                for kind, s, e in tokenize(text, skip=()):
+                    self.extra.append(text[s:e])
+                    toks.append((KIND_CODE[kind], -len(self.extra)))
+            for kind, start in toks:
+                kinds.append(kind)
+                starts.append(start)
+                ends.append(0)
+            last = j
+        kinds.extend(self.kinds[last:])
+        starts.extend(self.starts[last:])
+        ends.extend(self.ends[last:])
+        self.kinds, self.starts, self.ends = kinds, starts, ends
+
+    def chunks(self, marks=()):
+        """
+        Yields ('code' | 'string' | 'comment', text), merging consecutive code tokens.
+        marks is a sorted list of (i, key): ('mark', key) is yielded right before token i
+        (or at the end, for i == len(self)), ending the code run there.
+        """
+        string, comment = KIND_CODE['string'], KIND_CODE['comment']
+        code = []
+        marks = iter(marks)
+        at, key = next(marks, (None, None))
+        for i, k in enumerate(self.kinds):
+            while i == at:
+                if code: yield 'code', ''.join(code); code = []
+                yield 'mark', key
+                at, key = next(marks, (None, None))
+            if k == string or k == comment:
+                if code: yield 'code', ''.join(code); code = []
+                yield ('string' if k == string else 'comment'), self.value(i)
+            else:
+                code.append(self.value(i))
+        if code: yield 'code', ''.join(code)
+        while at is not None:
+            yield 'mark', key
+            at, key = next(marks, (None, None))
+
+    def size(self):
+        """Length of text() without materializing it."""
+        extra = self.extra
+        return sum(e - s if s >= 0 else len(extra[-s - 1]) for s, e in zip(self.starts, self.ends))
+
+    def pieces(self):
+        """Yields the token texts in order, for writing the stream out without building text()."""
+        source, extra = self.source, self.extra
+        for s, e in zip(self.starts, self.ends): yield source[s:e] if s >= 0 else extra[-s - 1]
+
+    def text(self):
+        return ''.join(self.pieces())
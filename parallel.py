@@ -0,0 +1,344 @@
+import re
+import zlib
+import multiprocessing
+from array import array
+
+from beautifier import iter_lines, iter_marked
+from lua_lexer import TOKEN_RE, TokenStream
+from simplify_math import ConstantFolder, _Binding, pad_edits
+
+# Smaller inputs run serially: starting the workers would cost more than it saves
+MIN_BYTES = 1 << 20
+MIN_CHUNK_BYTES = 1 << 16
+CHUNKS_PER_WORKER = 4
+# Average chunk size when chunks are cached between runs rather than spread over workers
+STABLE_CHUNK_BYTES = 1 << 14
+
+# Block keywords outside strings and comments. Quotes, '--' and '[' are resolved with the
+# lexer's own pattern, so strings and comments are skipped exactly where the lexer skips them.
+SCAN_RE = re.compile(r'''(?P<skip>--|["'\[])|(?<![\w.])(?P<kw>function|end|do|if|repeat|until|while|for|local)\b''')
+# Keywords that can only start a statement, so a chunk may begin at any of them
+STATEMENT_STARTS = frozenset(['local', 'if', 'for', 'while', 'repeat'])
+OPENERS = frozenset(['function', 'do', 'if', 'repeat'])
+
+def scan_blocks(code):
+    """
+    Block structure of code from one keyword scan, without tokenizing it.
+    Each block is [kind, body start, body end, statement starts, children]; the whole
+    file is the root block. Statement starts are the offsets of STATEMENT_STARTS keywords
+    directly inside the block.
+    """
+    root = ['chunk', 0, len(code), [], []]
+    stack, pos, search, match = [root], 0, SCAN_RE.search, TOKEN_RE.match
+    while True:
+        m = search(code, pos)
+        if m is None: break
+        if m.lastgroup == 'skip':
+            pos = match(code, m.start()).end()
+            continue
+        kw, pos = m.group('kw'), m.end()
+        top = stack[-1]
+        if kw in STATEMENT_STARTS: top[3].append(m.start())
+        if kw in OPENERS:
+            block = [kw, pos, len(code), [], []]
+            top[4].append(block)
+            stack.append(block)
+        elif kw in ('end', 'until') and len(stack) > 1:
+            stack.pop()[2] = m.start()
+    return root
+
+def main_block(code):
+    """The block holding most of the file, usually the body of an obfuscator's wrapper function."""
+    block = scan_blocks(code)
+    while True:
+        inner = max((b for b in block[4] if b[0] in ('function', 'do')), key=lambda b: b[2] - b[1], default=None)
+        if inner is None or inner[2] - inner[1] < len(code) // 2: return block
+        block = inner
+
+def plan_chunks(code, workers):
+    """
+    Offsets [s1, ..., sn, end] cutting the statements of the main block into chunks of
+    similar size, or None when there is nothing worth splitting. The plan is only a guess:
+    fold_parallel checks every boundary against the real tokens and parse.
+    """
+    block = main_block(code)
+    target = max(MIN_CHUNK_BYTES, (block[2] - block[1]) // (workers * CHUNKS_PER_WORKER))
+    cuts = []
+    for p in block[3]:
+        if not cuts or p - cuts[-1] >= target: cuts.append(p)
+    return cuts + [block[2]] if len(cuts) > 1 else None
+
+def plan_stable_chunks(code, size=STABLE_CHUNK_BYTES):
+    """
+    Like plan_chunks(), but a statement start becomes a cut when its first bytes hash to a
+    boundary, about once every `size` bytes. The cuts depend on nearby text only, so an edit
+    moves the cuts next to it and every other chunk keeps its exact text.
+    """
+    block = main_block(code)
+    starts = block[3]
+    period = max(1, len(starts) * size // max(1, block[2] - block[1]))
+    cuts = []
+    for p in starts:
+        if cuts and (p - cuts[-1] < size // 4 or zlib.crc32(code[p:p + 64].encode('utf-8', 'surrogatepass')) % period): continue
+        cuts.append(p)
+    return cuts + [block[2]] if len(cuts) > 1 else None
+
+class _Proxy(_Binding):
+    """A local of the enclosing code, known to a worker by the main process's key for it."""
+    __slots__ = ('key',)
+
+# Stands in for a dependency that a worker already saw reassigned
+_DEAD = _Binding()
+_DEAD.mutated = True
+
+class _ChunkFolder(ConstantFolder):
+    """
+    Folds one chunk of statements on its own, starting from a snapshot of the enclosing scopes,
+    and records every assumption the result makes about code outside the chunk.
+    """
+
+    def __init__(self, stream, context, nesting):
+        super().__init__(stream)
+        outer = {}
+        for name, key, alias, const in context:
+            outer[name] = b = _Proxy(alias, const)
+            b.key = key
+        self.scopes = [outer, {}]
+        self.nesting = nesting - 1  # fold() opens the chunk's _block, as the enclosing one is open
+        self.free, self.used, self.assigned = set(), {}, set()
+        self.balanced = True
+
+    def _leave(self, leak=False):
+        # An `end` closing a block opened before the chunk: the chunk is not a run of whole statements
+        if len(self.scopes) == 2: self.balanced = False
+        else: super()._leave(leak)
+
+    def _lookup(self, name):
+        b = super()._lookup(name)
+        if b is None: self.free.add(name)
+        elif type(b) is _Proxy: self.used[name] = b.key
+        return b
+
+    def _assigned(self, name):
+        b = self._lookup(name)
+        if b is None: self.assigned.add(name)
+        else: b.mutated = True
+
+    def report(self):
+        """Picklable result; None if the chunk is not balanced, {'abort': True} if Python ran out of stack."""
+        if not self.fold(): return {'abort': True}
+        if not self.balanced or len(self.scopes) != 2: return None
+        exports = list(self.scopes[1].items())
+        index = {b: i for i, (_, b) in enumerate(exports)}
+
+        def encode(deps):
+            refs = []
+            for b in deps:
+                if type(b) is _Proxy: refs.append(('x', b.key))
+                elif b in index: refs.append(('e', index[b]))
+                elif b.mutated: return None
+            return refs
+
+        edits = []
+        for s, e, res, deps in self.edits:
+            refs = encode(deps)
+            if refs is not None: edits.append((s, e, res, refs))
+        return {'abort': False, 'tokens': self.stream.arrays(), 'edits': edits,
+                'exports': [(name, b.alias, b.const, b.mutated, encode(b.deps)) for name, b in exports],
+                'free': self.free, 'used': self.used, 'assigned': self.assigned,
+                'mutated': [b.key for b in self.scopes[0].values() if b.mutated]}
+
+_source = None
+
+def _init_worker(source):
+    global _source
+    _source = source
+
+def _fold_span(source, start, end, context, nesting):
+    stream = TokenStream.from_span(source, start, end)
+    return None if stream is None else _ChunkFolder(stream, context, nesting).report()
+
+def _fold_chunk(job):
+    return _fold_span(_source, *job)
+
+class _MemoPool:
+    """
+    Stands in for the worker pool of fold_parallel(): folds chunks in this process, reusing
+    the reports of chunks folded in an earlier run with the same text and context.
+    Stored reports name the enclosing locals instead of keying them, and their token
+    offsets are relative to the chunk, so they survive edits elsewhere in the file.
+    """
+
+    def __init__(self, source, previous):
+        self.source, self.previous, self.memo = source, previous, {}
+        self.reused = self.folded = 0
+
+    def imap(self, func, jobs):
+        return map(self._fold, jobs)
+
+    def apply(self, func, args):
+        return self._fold(*args)
+
+    def _fold(self, job):
+        start, end, context, nesting = job
+        key = (self.source[start:end], tuple((name, alias, const) for name, _, alias, const in context), nesting)
+        stored = self.memo.get(key) or self.previous.get(key)
+        if stored is None:
+            res = _fold_span(self.source, start, end, context, nesting)
+            stored = res if not res or res['abort'] else self._rebase(res, -start, {key: name for name, key, _, _ in context})
+            self.folded += 1
+        else:
+            self.reused += 1
+        self.memo[key] = stored
+        return stored if not stored or stored['abort'] else self._rebase(stored, start, {name: key for name, key, _, _ in context})
+
+    @staticmethod
+    def _rebase(res, shift, keys):
+        """Copy of a report with token offsets moved by shift and enclosing locals renamed through keys."""
+        kinds, starts, ends = res['tokens']
+        code = starts.typecode
+        refs = lambda r: None if r is None else [(tag, keys[ref] if tag == 'x' else ref) for tag, ref in r]
+        return dict(res, tokens=(kinds, array(code, [s + shift for s in starts]), array(code, [e + shift for e in ends])),
+                    edits=[(s, e, text, refs(r)) for s, e, text, r in res['edits']],
+                    exports=[(name, alias, const, mutated, refs(r)) for name, alias, const, mutated, r in res['exports']],
+                    used={name: keys[key] for name, key in res['used'].items()},
+                    mutated=[keys[key] for key in res['mutated']])
+
+class _Unsplittable(Exception):
+    pass
+
+class _MainFolder(ConstantFolder):
+    """Folds the code around the chunks; on reaching the first one it merges every chunk, in order."""
+
+    def __init__(self, stream, first, merge):
+        super().__init__(stream)
+        self.breakpoints = {first}
+        self.merge, self.merged = merge, False
+        self.registry = {}  # key -> binding, for every binding a worker was told about
+        self.roots = {path.split('.')[0] for path in self.funcs}
+
+    def on_breakpoint(self):
+        self.breakpoints = ()
+        self.merge(self)
+        self.merged = True
+
+    def context(self):
+        """Snapshot of every visible local as (name, key, alias, const)."""
+        visible = {}
+        for scope in self.scopes: visible.update(scope)
+        self.registry.update((id(b), b) for b in visible.values())
+        return [(name, id(b), b.alias, b.const) for name, b in visible.items()]
+
+    def consistent(self, res):
+        """Whether a worker's view of names outside its chunk matches the real scopes here."""
+        for name in res['free']:
+            b = self._lookup(name)
+            # Unknown locals fold like globals, unless they shadow a library
+            if b is not None and (b.alias or b.const is not None or name in self.roots): return False
+        return all(self._lookup(name) is self.registry[key] for name, key in res['used'].items())
+
+    def absorb(self, res, base, edits):
+        """Applies a chunk's assignments and locals to the current scope; its edits go to `edits`."""
+        registry = self.registry
+        for key in res['mutated']: registry[key].mutated = True
+        for name in res['assigned']:
+            b = self._lookup(name)
+            if b is not None: b.mutated = True
+        exported = [_Binding(alias, const) for _, alias, const, _, _ in res['exports']]
+
+        def decode(refs):
+            if refs is None: return (_DEAD,)
+            deps = ()
+            for tag, ref in refs:
+                # Worker-side deps are already flattened, except through the proxies
+                if tag == 'x': deps += (registry[ref],) + registry[ref].deps
+                else: deps += (exported[ref],)
+            return deps
+
+        scope = self.scopes[-1]
+        for (name, _, _, mutated, refs), b in zip(res['exports'], exported):
+            b.deps, b.mutated = decode(refs), mutated
+            scope[name] = b
+        for s, e, text, refs in res['edits']: edits.append((s + base, e + base, text, decode(refs)))
+
+def fold_parallel(code, pool, plan):
+    """
+    Pass 1 with the statements of the file's main block, cut at the offsets of `plan`, folded
+    on a multiprocessing pool whose workers ran _init_worker(code). Produces exactly the stream and edit count of a
+    serial ConstantFolder, or returns None when the code cannot be split safely.
+
+    The main process folds the code before the first chunk, then hands each worker its chunk
+    with a snapshot of the visible locals. Results are merged in order; a chunk whose view of
+    the names outside it turns out wrong (e.g. it used an alias an earlier chunk declared) is
+    folded again with the exact scopes. Every fold is dropped or kept only at the end, once
+    all reassignments are known.
+    """
+    if plan is None: return None
+    prefix = TokenStream.from_span(code, 0, plan[0])
+    if prefix is None: return None
+    suffix = TokenStream.from_span(code, plan[-1], len(code))
+    hole = len(prefix)
+    chunks, edits = [], []
+
+    def merge(folder):
+        context, nesting = folder.context(), folder.nesting
+        jobs = [(s, e, context, nesting) for s, e in zip(plan, plan[1:])]
+        for job, res in zip(jobs, pool.imap(_fold_chunk, jobs)):
+            if res and not res['abort'] and not folder.consistent(res):
+                res = pool.apply(_fold_chunk, ((job[0], job[1], folder.context(), nesting),))
+            if res is None: raise _Unsplittable
+            if res['abort']: raise RecursionError
+            folder.absorb(res, hole + sum(len(c[0]) for c in chunks), edits)
+            chunks.append(res['tokens'])
+
+    main = TokenStream.concat(code, [prefix.arrays(), suffix.arrays()])
+    folder = _MainFolder(main, sum(1 for _ in prefix.iter_significant()), merge)
+    try:
+        if not folder.fold(): return TokenStream(code), len(folder.edits)
+    except _Unsplittable:
+        return None
+    if not folder.merged: return None
+    shift = sum(len(c[0]) for c in chunks)
+    for s, e, text, deps in folder.edits:
+        edits.append((s + shift if s >= hole else s, e + shift if e > hole else e, text, deps))
+    edits = [e for e in edits if not any(b.mutated for b in e[3])]
+    stream = TokenStream.concat(code, [prefix.arrays()] + chunks + [suffix.arrays()])
+    stream.splice(pad_edits(stream, edits))
+    return stream, len(edits)
+
+def fold(code, workers=None, session=None):
+    """
+    Pass 1, on `workers` processes when given; returns (stream, edit count).
+    With an incremental.Session, folds in this process instead and reuses the chunks the
+    session's previous run folded.
+    """
+    if session is not None:
+        pool = _MemoPool(code, session.chunks)
+        done = fold_parallel(code, pool, plan_stable_chunks(code))
+        session.chunks = pool.memo
+        session.stats.update(chunks=pool.reused + pool.folded, chunks_reused=pool.reused)
+        if done: return done
+    elif workers and workers > 1:
+        with multiprocessing.Pool(workers, _init_worker, (code,)) as pool:
+            done = fold_parallel(code, pool, plan_chunks(code, workers))
+        if done: return done
+    stream = TokenStream(code)
+    folder = ConstantFolder(stream)
+    folder.run()
+    return stream, len(folder.edits)
+
+def beautify_lines(stream, workers=None, session=None, marks=None):
+    """
+    Pass 5 as a generator of output lines, formatting the code between strings and comments
+    on `workers` processes when given. With an incremental.Session, only the code runs its
+    previous run did not format are formatted, in this process.
+    With marks (see TokenStream.chunks()), yields the (key, text) pieces of beautifier.iter_marked() instead.
+    """
+    lines, chunks = (iter_lines, stream.chunks()) if marks is None else (iter_marked, stream.chunks(marks))
+    if session is not None:
+        yield from lines(chunks, fmt=session.formatter())
+    elif workers and workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            yield from lines(chunks, pool)
+    else:
+        yield from lines(chunks)
@@ -0,0 +1,69 @@
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def _max_rss():
+    """Process high-water RSS in bytes, where the platform reports it."""
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # macOS reports bytes, Linux and the BSDs KiB
+
+class PassProfiler:
+    """
+    Per-pass instrumentation for the de-obfuscation pipeline.
+    deobfuscate() calls start(name) / end(**stats) around every pass; each pass record
+    gets wall and CPU time plus whatever counters the pass reports.
+      hook   -- optional callable, receives a dict event when each pass starts and ends
+      memory -- track per-pass peak Python allocations with tracemalloc (slows the run down)
+    """
+
+    def __init__(self, hook=None, memory=False):
+        self.hook = hook
+        self.memory = memory
+        self.passes = []
+        self._current = None
+        self._own_tracing = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracing = True
+
+    def start(self, name, **stats):
+        self._current = {'pass': name, **stats}
+        if self.memory: tracemalloc.reset_peak()
+        if self.hook: self.hook({'event': 'start', 'pass': name, **stats})
+        self._t0, self._c0 = time.perf_counter(), time.process_time()
+
+    def end(self, **stats):
+        wall = time.perf_counter() - self._t0
+        cpu = time.process_time() - self._c0
+        rec = self._current
+        rec.update(stats, wall=round(wall, 6), cpu=round(cpu, 6))
+        if self.memory: rec['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        self.passes.append(rec)
+        self._current = None
+        if self.hook: self.hook({'event': 'end', **rec})
+
+    def timings(self):
+        return {p['pass']: p['wall'] for p in self.passes}
+
+    def report(self):
+        """Structured summary of every finished pass, ready for json.dumps."""
+        if self._own_tracing:
+            tracemalloc.stop()
+            self._own_tracing = False
+        report = {
+            'passes': self.passes,
+            'total': {
+                'wall': round(sum(p['wall'] for p in self.passes), 6),
+                'cpu': round(sum(p['cpu'] for p in self.passes), 6),
+                'max_rss_bytes': _max_rss(),
+            },
+        }
+        # A pass that raised (or is still running) is reported so failures show where they happened
+        if self._current: report['unfinished'] = self._current
+        return report
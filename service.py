@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import argparse
+import socketserver
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backends import BACKENDS
+from cache import Cache, DEFAULT_DIR
+from unvm import deobfuscate
+
+# Boolean request options forwarded to deobfuscate(), besides `backend`; anything else in the request is ignored
+FLAGS = ('beautify', 'archive', 'remove_vm')
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+_cache = None
+
+def _init_worker(cache_dir):
+    """Runs once per worker: opens the shared cache. Importing unvm already warmed the regexes."""
+    global _cache
+    _cache = Cache(cache_dir) if cache_dir else None
+
+def _ping():
+    return os.getpid()
+
+def _run(source, options):
+    return deobfuscate(source, cache=_cache, **options)
+
+class DeobfuscationHandler(BaseHTTPRequestHandler):
+    """
+    POST /deobfuscate -- body is the Lua source (text/plain), or JSON
+                         {"source": ..., "options": {"beautify": bool, "archive": bool, "remove_vm": bool,
+                                                     "backend": name}}.
+                         Answers {"output": ..., "info": {...}}.
+    GET  /health      -- {"status": "ok", "workers": n}
+    """
+    server_version = "unvm/1"
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health': return self._send(404, {'error': f"unknown path {self.path}"})
+        self._send(200, {'status': 'ok', 'workers': self.server.workers})
+
+    def do_POST(self):
+        if self.path != '/deobfuscate': return self._send(404, {'error': f"unknown path {self.path}"})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            # A negative length would make rfile.read() wait for the client to close the connection
+            if length < 0: raise ValueError(f"negative Content-Length {length}")
+            if length > MAX_REQUEST_BYTES: return self._send(413, {'error': f"request over {MAX_REQUEST_BYTES} bytes"})
+            body = self.rfile.read(length)
+            if self.headers.get_content_type() == 'application/json':
+                req = json.loads(body)
+                source, options = req['source'], req.get('options') or {}
+            else:
+                source, options = body.decode('utf-8'), {}
+            if not isinstance(source, str): raise TypeError(f"source must be a string, not {type(source).__name__}")
+            backend = options.get('backend')
+            options = {k: v for k, v in options.items() if k in FLAGS}
+            for k, v in options.items():
+                if not isinstance(v, bool): raise ValueError(f"option {k} must be true or false, not {v!r}")
+            if backend is not None:
+                if not isinstance(backend, str) or backend not in BACKENDS: raise ValueError(f"unknown backend {backend!r}")
+                options['backend'] = backend
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return self._send(400, {'error': f"bad request: {e}"})
+        try: output, info = self.server.submit(source, options)
+        except concurrent.futures.TimeoutError:
+            return self._send(504, {'error': f"exceeded {self.server.timeout_s}s"})
+        except ValueError as e:
+            return self._send(422, {'error': str(e)})
+        except Exception as e:
+            return self._send(500, {'error': f"{type(e).__name__}: {e}"})
+        self._send(200, {'output': output, 'info': info})
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose: print(f"{self.command} {self.path}: {fmt % args}", file=sys.stderr)
+
+class _Service:
+    """Mixin holding the worker pool shared by every request thread."""
+    daemon_threads = True
+
+    def setup_pool(self, workers, cache_dir, timeout, verbose):
+        self.workers, self.timeout_s, self.verbose = workers, timeout, verbose
+        self.pool = None
+        if workers:
+            self.pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cache_dir,))
+            # Start every worker now, so the first requests don't pay for process start-up and imports
+            for f in [self.pool.submit(_ping) for _ in range(workers)]: f.result()
+        else:
+            _init_worker(cache_dir)
+
+    def submit(self, source, options):
+        if not self.pool: return _run(source, options)
+        # A timed-out job keeps its worker busy until it finishes; the client just stops waiting
+        return self.pool.submit(_run, source, options).result(self.timeout_s)
+
+    def server_close(self):
+        super().server_close()
+        if self.pool: self.pool.shutdown(cancel_futures=True)
+
+class HTTPService(_Service, ThreadingHTTPServer):
+    pass
+
+class UnixService(_Service, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    def get_request(self):
+        conn, _ = super().get_request()
+        return conn, ('unix', 0)  # BaseHTTPRequestHandler expects a (host, port) address
+
+def make_server(host='127.0.0.1', port=8765, unix=None, workers=None, cache_dir=DEFAULT_DIR, timeout=None, verbose=False):
+    """
+    Builds (but does not start) the de-obfuscation service.
+    Listens on a Unix socket when `unix` is a path, otherwise on host:port over HTTP.
+    workers=0 runs every request in its handler thread; otherwise a pool of that many
+    pre-started processes (default: CPU count) does the work, so requests run in parallel.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    if unix:
+        if os.path.exists(unix): os.remove(unix)
+        server = UnixService(unix, DeobfuscationHandler)
+    else:
+        server = HTTPService((host, port), DeobfuscationHandler)
+    server.setup_pool(workers, cache_dir, timeout, verbose)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve XHider de-obfuscation over local HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="bind address (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port (default: 8765)")
+    parser.add_argument('--unix', metavar='PATH', default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="worker processes, 0 for in-thread (default: CPU count)")
+    parser.add_argument('-t', '--timeout', type=float, default=None, help="per-request time limit in seconds")
+    parser.add_argument('--no-cache', action='store_true', help="bypass the on-disk cache")
+    parser.add_argument('--cache-dir', default=DEFAULT_DIR, help="cache location (default: ~/.cache/unvm)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request to stderr")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.unix, args.workers,
+                         None if args.no_cache else args.cache_dir, args.timeout, args.verbose)
+    where = args.unix or f"http://{args.host}:{args.port}"
+    print(f"Serving on {where} with {server.workers or 'no'} worker processes.", file=sys.stderr)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        server.server_close()
+        if args.unix and os.path.exists(args.unix): os.remove(args.unix)
+
+if __name__ == "__main__": main()
@@ -3,127 +3,692 @@ import math
 import sys
 import traceback
 
-def simplify_math_in_string(text):
+from lua_lexer import KIND_CODE, KINDS, TRIVIA, TokenStream, parse_string, quote_string
+
+# Lua operator priorities (left, right) as in lparser.c; right < left means right-associative.
+BINARY_PRIORITY = {
+    'or': (1, 1), 'and': (2, 2),
+    '<': (3, 3), '>': (3, 3), '<=': (3, 3), '>=': (3, 3), '~=': (3, 3), '==': (3, 3),
+    '|': (4, 4), '~': (5, 5), '&': (6, 6), '<<': (7, 7), '>>': (7, 7),
+    '..': (9, 8), '+': (10, 10), '-': (10, 10),
+    '*': (11, 11), '/': (11, 11), '//': (11, 11), '%': (11, 11),
+    '^': (14, 13),
+}
+UNARY_PRIORITY = 12
+UNARY_OPS = ('-', 'not', '#', '~')
+# Luau compound assignment (`n += 1`) is lexed as one of these followed by '='
+COMPOUND_OPS = frozenset(['+', '-', '*', '/', '//', '%', '^', '..'])
+
+MATH_FUNCS = {
+    'math.floor': math.floor,
+    'math.ceil': math.ceil,
+    'math.abs': abs,
+    'math.sqrt': math.sqrt,
+}
+
+MASK32 = 0xFFFFFFFF
+
+def _integer(x):
+    """An integral Lua number as int; anything else cannot be folded."""
+    if isinstance(x, float) and x.is_integer(): return int(x)
+    if isinstance(x, int) and not isinstance(x, bool): return x
+    raise ValueError("not an integer")
+
+def _u32(x):
+    return _integer(x) & MASK32
+
+def _shift(x, n):
+    x, n = _u32(x), _integer(n)
+    if abs(n) >= 32: return 0
+    return (x << n) & MASK32 if n >= 0 else x >> -n
+
+def _arshift(x, n):
+    x, n = _u32(x), _integer(n)
+    if n < 0 or not x & 0x80000000: return _shift(x, -n)
+    return MASK32 if n >= 32 else ((x >> n) | ~(MASK32 >> n)) & MASK32
+
+def _rotate(x, n):
+    x, n = _u32(x), _integer(n) % 32
+    return ((x << n) | (x >> (32 - n))) & MASK32
+
+def _field(field, width):
+    field, width = _integer(field), _integer(width)
+    if field < 0 or width <= 0 or field + width > 32: raise ValueError("bit32 field out of range")
+    return field, (1 << width) - 1
+
+def _extract(n, field, width=1):
+    field, mask = _field(field, width)
+    return (_u32(n) >> field) & mask
+
+def _replace(n, v, field, width=1):
+    field, mask = _field(field, width)
+    return (_u32(n) & ~(mask << field) | (_u32(v) & mask) << field) & MASK32
+
+def _reduce(op, start):
+    def fold(*xs):
+        acc = start
+        for x in xs: acc = op(acc, _u32(x))
+        return acc
+    return fold
+
+# Lua 5.2 bit32: every operand is reduced modulo 2^32 and results are unsigned
+BIT32_FUNCS = {
+    'bit32.band': _reduce(lambda a, b: a & b, MASK32),
+    'bit32.bor': _reduce(lambda a, b: a | b, 0),
+    'bit32.bxor': _reduce(lambda a, b: a ^ b, 0),
+    'bit32.bnot': lambda x: ~_u32(x) & MASK32,
+    'bit32.lshift': _shift,
+    'bit32.rshift': lambda x, n: _shift(x, -_integer(n)),
+    'bit32.arshift': _arshift,
+    'bit32.lrotate': _rotate,
+    'bit32.rrotate': lambda x, n: _rotate(x, -_integer(n)),
+    'bit32.extract': _extract,
+    'bit32.replace': _replace,
+}
+
+def _string_char(*codes):
+    if not all(0 <= _integer(c) <= 255 for c in codes): raise ValueError("char out of range")
+    return ''.join(chr(_integer(c)) for c in codes)
+
+def _string_byte(s, i=1, j=None):
+    """Only the single-result form folds; `string.byte(s, 1, 3)` yields several values."""
+    if not isinstance(s, str): raise TypeError("string.byte needs a string")
+    n, i = len(s), _integer(i)
+    j = i if j is None else _integer(j)
+    i = i if i > 0 else 1 if i == 0 or i < -n else n + i + 1
+    j = n if j > n else j if j >= 0 else 0 if j < -n else n + j + 1
+    if i != j: raise ValueError("string.byte must yield exactly one value")
+    return ord(s[i - 1])
+
+STRING_FUNCS = {
+    'string.char': _string_char,
+    'string.byte': _string_byte,
+}
+
+# Every call the folder evaluates when all arguments are constants, by library path
+LIBRARY_FUNCS = {**MATH_FUNCS, **BIT32_FUNCS, **STRING_FUNCS}
+
+ARITH = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '//': lambda a, b: a // b,
+    '%': lambda a, b: a % b,
+    '^': math.pow,
+}
+
+def parse_number(tok):
+    """Converts a Lua numeral to int/float, or None if it is malformed."""
+    low = tok.lower()
+    try:
+        if low.startswith('0x'):
+            return float.fromhex(tok) if '.' in low or 'p' in low else int(tok, 16)
+        return float(tok) if '.' in low or 'e' in low else int(tok)
+    except ValueError:
+        return None
+
+def format_value(val):
+    """Renders a folded number or string as a Lua literal, or None if it cannot be written."""
+    return quote_string(val) if isinstance(val, str) else format_number(val)
+
+def format_number(val):
+    """Renders a folded value as a Lua numeral, or None if it has no finite numeral form."""
+    if isinstance(val, bool) or not isinstance(val, (int, float)): return None
+    if isinstance(val, int):
+        if abs(val) <= 2**53: return str(val)
+        val = float(val)
+    if not math.isfinite(val): return None
+    if val.is_integer() and abs(val) < 1e16: return str(int(val))
+    return repr(val)
+
+def _is_number(val):
+    return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+# String literals longer than this are never parsed (or copied) by the folder
+STRING_LIMIT = 4096
+# A statement nesting blocks/expressions deeper than this is left unfolded. An explicit count
+# (rather than Python's recursion limit) makes the cut-off independent of the caller's stack,
+# so a chunk folded on its own hits it exactly where the whole file would.
+MAX_NESTING = 200
+# Keywords that can occur inside an expression; any other one ends a skipped statement
+EXPRESSION_KEYWORDS = frozenset(['and', 'or', 'not', 'nil', 'true', 'false', 'function'])
+# Tokens that can end an operand (besides names, numbers and strings): a name right after one,
+# outside brackets, starts the next statement
+OPERAND_ENDS = frozenset([')', ']', '}', '...', 'end', 'nil', 'true', 'false'])
+
+class _Kinds:
+    """kinds[p]: kind of the p-th significant token, from one byte per token; None at n and -1."""
+    __slots__ = ('codes',)
+    NAMES = KINDS + (None,)
+
+    def __init__(self, stream):
+        self.codes = stream.kinds.tobytes().translate(None, bytes(TRIVIA)) + bytes([len(KINDS)])
+
+    def __getitem__(self, p):
+        return self.NAMES[self.codes[p]]
+
+class _Values:
     """
-    Finds mathematical expressions in a string and replaces them with their evaluated results.
-    Uses markers to protect strings and comments from being modified.
+    vals[p]: text of the p-th significant token, sliced from the stream when asked for, with
+    string literals cut to `clip` characters; None at n and -1. The stream must not be
+    spliced while the view is in use.
+    """
+    __slots__ = ('source', 'starts', 'ends', 'extra', 'sig', 'codes', 'clip')
+    STRING = KIND_CODE['string']
+    END = len(KINDS)
+
+    def __init__(self, stream, sig, kinds, clip):
+        self.source, self.extra = stream.source, stream.extra
+        self.starts, self.ends = stream.starts, stream.ends
+        self.sig, self.codes, self.clip = sig, kinds.codes, clip
+
+    def __getitem__(self, p):
+        code = self.codes[p]
+        if code == self.END: return None
+        i = self.sig[p]
+        s = self.starts[i]
+        if s < 0:
+            text = self.extra[-s - 1]
+            return text[:self.clip] if code == self.STRING else text
+        e = self.ends[i]
+        if code == self.STRING and e - s > self.clip: e = s + self.clip
+        return self.source[s:e]
+
+class _Node:
+    __slots__ = ('val', 'start', 'end', 'composite', 'deps')
+
+    def __init__(self, val, start, end, composite, deps=()):
+        self.val, self.start, self.end, self.composite = val, start, end, composite
+        self.deps = deps  # bindings whose value the fold relied on
+
+class _Unparsable(Exception):
+    """A statement the folder cannot read, e.g. a truncated `<attrib>`; it is skipped like an over-deep one."""
+
+class _Binding:
+    """A local variable: the library path it aliases or the constant it holds, if any."""
+    __slots__ = ('alias', 'const', 'deps', 'mutated')
+
+    def __init__(self, alias=None, const=None, deps=()):
+        self.alias, self.const, self.deps, self.mutated = alias, const, deps, False
+
+class ConstantFolder:
+    """
+    Single-pass Lua constant folder over a TokenStream.
+    Parses every expression with Lua's own precedence rules and folds constant subtrees
+    bottom-up; only maximal constant subtrees are rewritten, every other token is untouched.
+    Node spans are [start, end) indices into the stream.
+
+    Locals are resolved per scope in the same traversal: `local r = math.floor` or
+    `local s = string` make r / s.char foldable library calls, and `local n = 5` makes n a
+    constant. Any later assignment to such a local drops every fold that relied on it.
+    funcs maps library paths to Python implementations (default LIBRARY_FUNCS).
     """
-    
-    # 1. Identify definition aliases for math.floor, math.ceil, etc.
-    # Pattern: local <alias> = math.floor
-    floor_defs = {}
-    for m in re.finditer(r'local\s+(\w+)\s*=\s*(math\.(floor|ceil|abs|sqrt))', text):
-        alias = m.group(1)
-        real_func = m.group(2)
-        floor_defs[alias] = real_func
-    
-    protected = []
-    def protect_callback(match):
-        protected.append(match.group(0))
-        return f"___PROTECTED_MARKER_{len(protected)-1}___"
-    
-    # Protect Lua strings and comments
-    # Order: block comments, block strings, line comments, normal strings
-    # We use [^\n]* for line comments to stay on one line even with DOTALL
-    protect_pattern = r'(--\[\[.*?\]\])|(--[^\n]*)|("(?:\\.|[^"])*")|(\'(?:\\.|[^\'])*\')|(\[\[.*?\]\])'
-    working_text = re.sub(protect_pattern, protect_callback, text, flags=re.DOTALL)
-
-    def evaluate_math(expr):
-        """Evaluates a mathematical expression string using Python's eval."""
-        python_expr = expr.replace('^', '**')
-        
-        # Replace identified aliases with Python math functions
-        for alias, real in floor_defs.items():
-            python_expr = re.sub(r'\b' + re.escape(alias) + r'\(', f'{real}(', python_expr)
 
+    def __init__(self, stream, funcs=None):
+        self.stream = stream
+        self.funcs = LIBRARY_FUNCS if funcs is None else funcs
+        self.modules = {path.rsplit('.', 1)[0] for path in self.funcs if '.' in path}
+        # Views over the significant tokens plus an end-of-input sentinel, so lookahead never
+        # bounds-checks. Nothing is copied per token: lists of kinds and texts took several
+        # times the memory of the stream itself. starts[p] is the stream index of token p,
+        # which ends at starts[p] + 1; starts[n] is len(stream).
+        self.starts = stream.significant()
+        self.n = len(self.starts)
+        self.kinds = _Kinds(stream)
+        self.vals = _Values(stream, self.starts, self.kinds, STRING_LIMIT + 1)
+        self.starts.append(len(stream))
+        self.peeked = (-1, None)  # (pos, _peek() there)
+        self.pos = 0
+        self.edits = []
+        self.scopes = [{}]
+        self.chain = (None, None)  # (node, library path) of the last plain `a.b.c` expression
+        self.nesting = 0  # open _block/_expr calls
+        self.breakpoints = ()  # values of pos where on_breakpoint() runs before a statement
+
+    def fold(self):
+        """Collects the edits without applying them; False if Python itself ran out of stack."""
         try:
-            # Safety check: allow digits, hex, ops, spaces, and whitelisted math functions
-            check_expr = python_expr
-            for f in ["math.floor", "math.ceil", "math.abs", "math.sqrt"]:
-                check_expr = check_expr.replace(f, '')
-            
-            # Remove hex numbers
-            check_expr = re.sub(r'0x[0-9a-fA-F]+', '', check_expr)
-            
-            # If any letters remain, it might be a variable or unsafe code
-            if re.search(r'[a-zA-Z_]', check_expr):
-                return None
-            
-            # Restricted eval environment
-            res = eval(python_expr, {"__builtins__": {}, "math": math}, {})
-            
-            if isinstance(res, (int, float)):
-                if isinstance(res, float) and res.is_integer():
-                    return str(int(res))
-                elif isinstance(res, float):
-                    if abs(res) < 1e12 and abs(res) > 1e-8:
-                        return f"{res:.15f}".rstrip('0').rstrip('.')
-                    return f"{res:.8g}"
-                return str(res)
-        except:
-            pass
+            self._block(nested=False)
+        except RecursionError:
+            return False
+        return True
+
+    def run(self):
+        if not self.fold(): return self.stream
+        self.edits = [e for e in self.edits if not any(b.mutated for b in e[3])]
+        edits = pad_edits(self.stream, self.edits)
+        # The views go stale with the splice; dropping them first keeps them out of its peak
+        self.starts = self.kinds = self.vals = self.peeked = None
+        self.stream.splice(edits)
+        return self.stream
+
+    def on_breakpoint(self):
+        pass
+
+    # -- token helpers --
+
+    def _peek(self):
+        # Each position is peeked several times (statement, expression and suffix loops), and
+        # reading a token from the views costs more than a list lookup did
+        pos, tok = self.peeked
+        if pos != self.pos:
+            pos = self.pos
+            tok = self.kinds[pos], self.vals[pos]
+            self.peeked = pos, tok
+        return tok
+
+    def _function(self, assign):
+        """Consumes `[name] ( params )` after 'function' and opens the body's scope."""
+        start, params, opened, method = self.pos, [], False, False
+        while self.pos < self.n:
+            kind, tok = self._peek()
+            self.pos += 1
+            if tok == ')': break
+            if tok == '(': opened = True
+            elif tok == ':': method = True
+            elif opened and kind == 'name': params.append(tok)
+        if assign and self.kinds[start] == 'name' and self.vals[start + 1] == '(':
+            self._assigned(self.vals[start])
+        self._enter(params + ['self'] if method else params)
+
+    # -- scopes --
+
+    def _enter(self, names=()):
+        self.scopes.append({name: _Binding() for name in names})
+
+    def _leave(self, leak=False):
+        if len(self.scopes) == 1: return
+        scope = self.scopes.pop()
+        # `until` still sees the repeat body's locals; shadow them rather than guess
+        if leak: self.scopes[-1].update((name, _Binding()) for name in scope)
+
+    def _lookup(self, name):
+        for scope in reversed(self.scopes):
+            b = scope.get(name)
+            if b is not None: return b
         return None
 
-    # Iterative simplification
-    current = working_text
-    changed = True
-    iteration = 0
-    
-    num_part = r'(?:0x[0-9a-fA-F]+|\d+(?:\.\d*)?)'
-    op_part = r'(?:\s*[\+\-\*\/\%\^]\s*)'
-    # Binary op pattern: optional leading sign, num, then (op, optional sign, num)+
-    bin_op_pattern = r'(?<![a-zA-Z0-9_])[+-]?\s*' + num_part + r'(?:' + op_part + r'[+-]?\s*' + num_part + r')+(?![0-9a-fA-Fx\.])'
-    
-    while changed and iteration < 150:
-        old = current
-        
-        # 1. Simplify innermost parentheses ( ... )
-        # Pattern ensures we find content with no nested parentheses or markers
-        inner_paren_pattern = r'\(\s*([0-9a-fA-Fx\.\s\+\-\*\/\%\^]+)\s*\)'
-        
-        def paren_repl(m):
-            content = m.group(1)
-            res = evaluate_math(content)
-            if res is not None:
-                # Check if it was a function call: identifier immediately preceding '('
-                prefix = current[:m.start()].rstrip()
-                if prefix and re.search(r'[a-zA-Z_0-9$]$', prefix):
-                    return "(" + res + ")"
-                return " " + res + " "
-            return m.group(0)
-
-        current = re.sub(inner_paren_pattern, paren_repl, current)
-        
-        # 2. Simplify math function calls with constant arguments
-        all_funcs = ["math.floor", "math.ceil", "math.abs", "math.sqrt"] + list(floor_defs.keys())
-        for f_name in all_funcs:
-            alias_esc = re.escape(f_name)
-            # Pattern: func_name( constant_math )
-            fp = r'\b' + alias_esc + r'\s*\(\s*([0-9a-fA-Fx\.\s\+\-\*\/\%\^]+)\s*\)'
-            def func_repl(m):
-                res = evaluate_math(m.group(0))
-                return " " + res + " " if res is not None else m.group(0)
-            current = re.sub(fp, func_repl, current)
-
-        # 3. Simplify contiguous binary operations
-        def binop_repl(m):
-            res = evaluate_math(m.group(0))
-            return " " + res + " " if res is not None else m.group(0)
-        
-        current = re.sub(bin_op_pattern, binop_repl, current)
-        
-        if current == old:
-            changed = False
-        iteration += 1
-
-    # 4. Restore protected markers
-    def restore_callback(match):
-        idx = int(match.group(1))
-        return protected[idx]
-    
-    final_text = re.sub(r'___PROTECTED_MARKER_(\d+)___', restore_callback, current)
-    
-    # 5. Result Cleanup
+    def _assigned(self, name):
+        b = self._lookup(name)
+        if b is not None: b.mutated = True
+
+    def _local(self):
+        """`local a, b <const> = e1, e2` and `local function f`: binds after evaluating the values."""
+        if self._peek()[1] == 'function':
+            self.scopes[-1][self.vals[self.pos + 1]] = _Binding()
+            return
+        names = []
+        while self._peek()[0] == 'name':
+            names.append(self._peek()[1])
+            self.pos += 1
+            if self._peek()[1] == '<':  # attribute
+                if self.kinds[self.pos + 1] != 'name' or self.vals[self.pos + 2] != '>': raise _Unparsable()
+                self.pos += 3
+            if self._peek()[1] != ',': break
+            self.pos += 1
+        bindings = []
+        if self._peek()[1] == '=':
+            self.pos += 1
+            while self.pos < self.n:
+                node = self._expr(0)
+                if node is None: break
+                self._emit(node)
+                if self.chain[0] is node and self.chain[1]:
+                    bindings.append(_Binding(alias=self.chain[1], deps=node.deps))
+                elif node.val is not None:
+                    bindings.append(_Binding(const=node.val, deps=node.deps))
+                else:
+                    bindings.append(_Binding())
+                if self._peek()[1] != ',': break
+                self.pos += 1
+        scope = self.scopes[-1]
+        for i, name in enumerate(names):
+            scope[name] = bindings[i] if i < len(bindings) else _Binding()
+
+    # -- statements --
+
+    def _block(self, nested):
+        """Scans statements; when nested, returns after the 'end' closing the current function."""
+        self.nesting += 1
+        if self.nesting > MAX_NESTING: raise RecursionError("nesting over MAX_NESTING")
+        try:
+            depth = 0
+            loop_open = False  # a `for` already opened the scope its `do` would
+            targets, values = [], False  # names before `=` in `a, b = ...`; inside the value list
+            while True:
+                if self.pos in self.breakpoints: self.on_breakpoint()
+                if self.pos >= self.n: break
+                kind, tok = self._peek()
+                start, edits, scopes = self.pos, len(self.edits), len(self.scopes)
+                try:
+                    if kind == 'keyword' and tok not in ('nil', 'true', 'false', 'not'):
+                        self.pos += 1
+                        targets, values = [], False
+                        if tok in ('do', 'if', 'repeat'):
+                            depth += 1
+                            if tok == 'do' and loop_open: loop_open = False
+                            else: self._enter()
+                        elif tok in ('else', 'elseif'): self._leave(); self._enter()
+                        elif tok == 'function':
+                            depth += 1
+                            self._function(assign=self.vals[self.pos - 2] != 'local')
+                        elif tok == 'local': self._local()
+                        elif tok == 'for':
+                            names = []
+                            while self._peek()[0] == 'name':
+                                names.append(self._peek()[1])
+                                self.pos += 1
+                                if self._peek()[1] != ',': break
+                                self.pos += 1
+                            self._enter(names)
+                            loop_open = True
+                        elif tok in ('end', 'until'):
+                            self._leave(leak=(tok == 'until'))
+                            depth -= 1
+                            if depth < 0:
+                                if nested: return
+                                depth = 0
+                        continue
+                    if kind == 'name' and self.vals[self.pos + 1] in COMPOUND_OPS and self.vals[self.pos + 2] == '=':
+                        self._assigned(tok)
+                    node = self._expr(0)
+                    if node is not None:
+                        self._emit(node)
+                        nxt = self.vals[self.pos]
+                        bare = self.pos == start + 1 and self.kinds[start] == 'name'
+                        if nxt == '=' and not values:
+                            for name in targets + ([self.vals[start]] if bare else []): self._assigned(name)
+                            targets, values = [], True
+                        elif nxt == ',':
+                            if bare and not values: targets.append(self.vals[start])
+                        else:
+                            targets, values = [], False
+                    if self.pos == start: self.pos += 1
+                except (RecursionError, _Unparsable):
+                    targets, values = [], False
+                    self._skip(start, edits, scopes)
+        finally:
+            self.nesting -= 1
+
+    def _skip(self, start, edits, scopes):
+        """
+        Gives up on the statement at token `start` after it nested over MAX_NESTING (or could
+        not be read): drops the folds made inside it and resumes after it. Every name in it counts as assigned, and
+        a `local` statement still declares its names.
+        """
+        del self.edits[edits:]
+        del self.scopes[scopes:]
+        self.chain = (None, None)
+        kinds, vals = self.kinds, self.vals
+        declared, p = [], start + 1
+        if vals[start] == 'local':
+            while kinds[p] == 'name':
+                declared.append(vals[p])
+                p += 1
+                if vals[p] == '<':  # attribute
+                    if kinds[p + 1] != 'name' or vals[p + 2] != '>': break
+                    p += 3
+                if vals[p] != ',': break
+                p += 1
+        # The statement ends at the first keyword, unmatched closer, or name following a complete
+        # operand, outside its brackets and blocks
+        p, brackets, blocks = start + (vals[start] == 'local'), 0, 0
+        while p < self.n:
+            kind, tok = kinds[p], vals[p]
+            if kind == 'keyword':
+                if tok in ('function', 'do', 'if', 'repeat'):
+                    if not (brackets or blocks) and tok != 'function': break
+                    blocks += 1
+                elif tok in ('end', 'until'):
+                    if not blocks: break
+                    blocks -= 1
+                elif not (brackets or blocks) and tok not in EXPRESSION_KEYWORDS: break
+            elif kind == 'op' and tok in ('(', '[', '{'): brackets += 1
+            elif kind == 'op' and tok in (')', ']', '}'):
+                if not brackets: break
+                brackets -= 1
+            elif kind == 'name':
+                if p > start and not (brackets or blocks) and \
+                        (kinds[p - 1] in ('name', 'number', 'string') or vals[p - 1] in OPERAND_ENDS): break
+                self._assigned(tok)
+            p += 1
+        self.pos = max(p, start + 1)
+        for name in declared: self.scopes[-1][name] = _Binding()
+
+    # -- expressions --
+
+    def _expr(self, limit):
+        self.nesting += 1
+        if self.nesting > MAX_NESTING: raise RecursionError("nesting over MAX_NESTING")
+        try:
+            kind, tok = self._peek()
+            if tok in UNARY_OPS and kind in ('op', 'keyword'):
+                start = self.starts[self.pos]
+                self.pos += 1
+                operand = self._expr(UNARY_PRIORITY)
+                if operand is None: return None
+                val = None
+                if tok == '-' and _is_number(operand.val): val = -operand.val
+                elif tok == '#' and isinstance(operand.val, str): val = len(operand.val)
+                if val is None: self._emit(operand)
+                left = _Node(val, start, operand.end, operand.composite or tok != '-', operand.deps)
+            else:
+                left = self._simple()
+                if left is None: return None
+            while True:
+                kind, op = self._peek()
+                if kind not in ('op', 'keyword') or op not in BINARY_PRIORITY: break
+                lprio, rprio = BINARY_PRIORITY[op]
+                if lprio <= limit: break
+                self.pos += 1
+                if rprio < lprio:
+                    # Right-associative chains (`..`, `^`) are collected in one loop, so their
+                    # length does not count against MAX_NESTING; they still combine right to left.
+                    operands = [left]
+                    while True:
+                        right = self._expr(lprio)
+                        if right is None:
+                            for node in operands: self._emit(node)
+                            return None
+                        operands.append(right)
+                        if self.vals[self.pos] != op or self.kinds[self.pos] not in ('op', 'keyword'): break
+                        self.pos += 1
+                    right = operands.pop()
+                    while len(operands) > 1: right = self._combine(op, operands.pop(), right)
+                else:
+                    right = self._expr(rprio)
+                    if right is None:
+                        self._emit(left)
+                        return None
+                left = self._combine(op, left, right)
+            return left
+        finally:
+            self.nesting -= 1
+
+    def _combine(self, op, left, right):
+        val = None
+        if _is_number(left.val) and _is_number(right.val) and op in ARITH:
+            try: val = ARITH[op](left.val, right.val)
+            except (ArithmeticError, ValueError): val = None
+            if format_number(val) is None: val = None
+        if val is None:
+            self._emit(left, wrap_negative=(op == '^'))
+            self._emit(right)
+            return _Node(None, left.start, right.end, True)
+        return _Node(val, left.start, right.end, True, left.deps + right.deps)
+
+    def _simple(self):
+        kind, tok = self._peek()
+        if kind is None: return None
+        s, e = self.starts[self.pos], self.starts[self.pos] + 1
+        if kind == 'number':
+            self.pos += 1
+            val = parse_number(tok)
+            return _Node(val, s, e, False)
+        if kind == 'string':
+            self.pos += 1
+            return _Node(parse_string(tok) if len(tok) <= STRING_LIMIT else None, s, e, False)
+        if tok in ('nil', 'true', 'false', '...'):
+            self.pos += 1
+            return _Node(None, s, e, False)
+        if tok == 'function':
+            self.pos += 1
+            self._function(assign=False)
+            self._block(nested=True)
+            return _Node(None, s, self.starts[self.pos - 1] + 1, False)
+        if tok == '{':
+            return self._table()
+        return self._suffixed()
+
+    def _table(self):
+        s = self.starts[self.pos]
+        self.pos += 1
+        while self.pos < self.n:
+            kind, tok = self._peek()
+            if tok == '}':
+                self.pos += 1
+                return _Node(None, s, self.starts[self.pos - 1] + 1, False)
+            if tok in (',', ';', '=', ']', '['):
+                self.pos += 1
+                continue
+            start = self.pos
+            node = self._expr(0)
+            if node is not None: self._emit(node)
+            if self.pos == start: return _Node(None, s, self.starts[self.pos - 1] + 1, False)
+        return _Node(None, s, self.starts[-1], False)
+
+    def _suffixed(self):
+        kind, tok = self._peek()
+        s, e = self.starts[self.pos], self.starts[self.pos] + 1
+        if tok == '(':
+            self.pos += 1
+            inner = self._expr(0)
+            if inner is None: return None
+            if self._peek()[1] != ')':
+                self._emit(inner)
+                return None
+            self.pos += 1
+            # `("x")` is left alone; only computed strings are rewritten
+            composite = inner.composite or not isinstance(inner.val, str)
+            node = _Node(inner.val, s, self.starts[self.pos - 1] + 1, composite, inner.deps)
+            dotted = None
+        elif kind == 'name':
+            self.pos += 1
+            b = self._lookup(tok)
+            if b is None:
+                node, dotted = _Node(None, s, e, False), tok
+            else:
+                # A local shadows any library of the same name unless it aliases one
+                node, dotted = _Node(b.const, s, e, False, (b,) + b.deps), b.alias
+        else:
+            return None
+
+        while True:
+            kind, tok = self._peek()
+            if tok in ('.', ':') and kind == 'op':
+                self.pos += 1
+                k2, name = self._peek()
+                if k2 != 'name': return node
+                self.pos += 1
+                dotted = dotted + '.' + name if dotted and tok == '.' else None
+                node = self._as_prefix(node, self.starts[self.pos - 1] + 1)
+            elif tok == '[' and kind == 'op':
+                node = self._as_prefix(node)
+                self.pos += 1
+                key = self._expr(0)
+                if key is not None: self._emit(key)
+                if self._peek()[1] == ']': self.pos += 1
+                node.end = self.starts[self.pos - 1] + 1
+                dotted = None
+            elif (tok == '(' and kind == 'op') or kind == 'string' or tok == '{':
+                node = self._call(node, dotted)
+                dotted = None
+            else:
+                if dotted and (dotted in self.funcs or dotted in self.modules): self.chain = (node, dotted)
+                return node
+
+    def _as_prefix(self, node, end=None):
+        """A constant followed by an index or call is no longer foldable."""
+        return _Node(None, node.start, node.end if end is None else end, False, node.deps)
+
+    def _call(self, node, dotted):
+        kind, tok = self._peek()
+        node = self._as_prefix(node)
+        func = self.funcs.get(dotted) if dotted else None
+        if tok != '(':
+            arg = self._simple()
+            if arg is None: return node
+            # f"str" and f{...} take exactly one argument
+            if func and arg.val is not None:
+                folded = self._apply(func, [arg], node.start, arg.end, node.deps)
+                if folded: return folded
+            return _Node(None, node.start, arg.end, False)
+        self.pos += 1
+        args = []
+        while self.pos < self.n:
+            kind, tok = self._peek()
+            if tok == ')':
+                self.pos += 1
+                break
+            if tok == ',':
+                self.pos += 1
+                continue
+            start = self.pos
+            arg = self._expr(0)
+            if arg is not None: args.append(arg)
+            if self.pos == start: break
+        end = self.starts[self.pos - 1] + 1
+        if func and args and all(a.val is not None for a in args):
+            folded = self._apply(func, args, node.start, end, node.deps)
+            if folded: return folded
+        for a in args: self._emit(a)
+        return _Node(None, node.start, end, False)
+
+    def _apply(self, func, args, start, end, deps):
+        try: val = func(*[a.val for a in args])
+        except (ArithmeticError, ValueError, TypeError): return None
+        if format_value(val) is None: return None
+        for a in args: deps += a.deps
+        return _Node(val, start, end, True, deps)
+
+    # -- output --
+
+    def _emit(self, node, wrap_negative=False):
+        if node.val is None or not node.composite: return
+        res = format_value(node.val)
+        if res is None: return
+        if wrap_negative and res.startswith('-'): res = '(' + res + ')'
+        self.edits.append((node.start, node.end, res, node.deps))
+
+def pad_edits(stream, edits):
+    """Yields splice edits for the folder's (start, end, text, deps) edits, spaced apart from adjacent tokens."""
+    for s, e, res, _ in edits:
+        before = stream.value(s - 1)[-1:] if s > 0 else ''
+        after = stream.value(e)[:1] if e < len(stream) else ''
+        if before.isalnum() or before in ('_', '.') or (before == '-' and res.startswith('-')): res = ' ' + res
+        if after.isalnum() or after in ('_', '.'): res = res + ' '
+        yield s, e, res
+
+def fold_stream(stream, funcs=None):
+    """Folds every constant subexpression and library call (funcs, default LIBRARY_FUNCS) of a token stream in place."""
+    return ConstantFolder(stream, funcs).run()
+
+def fold_constants(text, funcs=None):
+    """Folds every constant subexpression and library call of a Lua chunk in one traversal."""
+    return fold_stream(TokenStream(text), funcs).text()
+
+def simplify_math_in_string(text):
+    """
+    Finds mathematical expressions in a string and replaces them with their evaluated results.
+    Strings and comments are skipped by the lexer, so they are never modified.
+    """
+
+    # 1. Fold constant expressions and library calls in a single traversal;
+    # local aliases such as `local r = math.floor` are resolved per scope by the folder
+    final_text = fold_constants(text)
+
+    # 2. Result Cleanup
     # Reduce multiple spaces to single spaces, but preserve newlines
     lines = final_text.splitlines()
     cleaned_lines = [re.sub(r' +', ' ', l).strip() for l in lines]
@@ -133,22 +698,22 @@ if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: py simplify_math.py <input_file> [output_file]")
         sys.exit(1)
-        
+
     input_file = sys.argv[1]
     output_file = sys.argv[2] if len(sys.argv) > 2 else input_file.replace(".lua", ".simplified.lua")
-    
+
     if output_file == input_file:
         output_file += ".final.lua"
-    
+
     try:
         with open(input_file, 'r', encoding='utf-8') as f:
             content = f.read()
-        
+
         result = simplify_math_in_string(content)
-        
+
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(result)
-        
+
         print(f"Successfully processed {input_file} -> {output_file}")
     except Exception as e:
         print(f"Error: {e}")
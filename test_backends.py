@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+import backends
+from backends import WINDOW_RECORDS, XOR_WINDOW, choose, detect, lua_vm_decode, lua_vm_decode_all
+from bench import ScriptGenerator
+from lua_lexer import TokenStream
+
+KEYS = [0x5A, 0x13, 0xC7, 0x81]
+
+def _pool(records, gap=0, seed=0):
+    """A pool of XHider records, each XORed from key phase 0 at its own start; returns (pool, offsets)."""
+    rng = random.Random(seed)
+    pool, offsets = bytearray(), []
+    for text in records:
+        pool += bytes(rng.randrange(256) for _ in range(gap))
+        raw = len(text).to_bytes(4, 'little') + text.encode('latin-1')
+        offsets.append(len(pool))
+        pool += bytes(b ^ KEYS[j % 4] for j, b in enumerate(raw))
+    return bytes(pool), offsets
+
+def _expected(pool, offsets):
+    return {o: s for o in offsets if (s := lua_vm_decode(pool, KEYS, o)) is not None}
+
+def test_decode_all_dense_records_use_windows():
+    rng = random.Random(1)
+    records = [''.join(chr(rng.randrange(256)) for _ in range(rng.randrange(60))) for _ in range(4000)]
+    pool, offsets = _pool(records)
+    # Every key phase holds enough records per window, and some cross a window's end
+    assert len(pool) > 2 * XOR_WINDOW and len(offsets) // 4 > WINDOW_RECORDS * len(pool) // XOR_WINDOW
+    got = lua_vm_decode_all(pool, KEYS, offsets)
+    assert got == _expected(pool, offsets) and [got[o] for o in offsets] == records
+
+def test_decode_all_sparse_records_one_by_one():
+    records = ['print', '', 'x' * 300, 'tail']
+    pool, offsets = _pool(records, gap=XOR_WINDOW // 3 + 1)
+    got = lua_vm_decode_all(pool, KEYS, offsets)
+    assert got == _expected(pool, offsets) and [got[o] for o in offsets] == records
+
+@pytest.mark.parametrize('gap', [0, XOR_WINDOW // 3])
+def test_decode_all_skips_out_of_range_offsets(gap):
+    pool, offsets = _pool(['a' * 20] * (WINDOW_RECORDS * 2), gap=gap)
+    pool = pool[:-5]  # the last record's text runs past the end
+    wanted = offsets + [len(pool) - 2, len(pool), len(pool) + 100]
+    got = lua_vm_decode_all(bytearray(pool), KEYS, [str(o) for o in wanted])
+    assert got == _expected(pool, wanted) and set(got) == set(offsets[:-1])
+
+def test_detect_scores_each_fingerprint_once():
+    stream = TokenStream(ScriptGenerator(seed=1).generate(20000))
+    assert [(score, b.name) for score, b in detect(stream)] == [(6, 'xhider')]
+    # A second banner comment adds nothing; the pool string alone scores its own weight
+    assert detect(TokenStream('-- XHider\n-- XHider\nlocal a = 1'))[0][0] == 4
+    assert detect(TokenStream(f'local p = "{"ab" * 150}"'))[0][0] == 2
+    assert detect(TokenStream('local s = "-- XHider" -- made by XHiderish'))[0][0] == 0
+
+def test_choose_falls_back_and_honours_a_name():
+    plain = TokenStream('local a = 1 print(a)')
+    assert choose(plain) == (backends.BACKENDS['xhider'], 0)
+    assert choose(plain, 'xhider') == (backends.BACKENDS['xhider'], None)
+    with pytest.raises(ValueError, match="Unknown backend"): choose(plain, 'nope')
@@ -0,0 +1,26 @@
+import os
+import time
+
+import batch
+import cache
+from bench import ScriptGenerator
+
+def _write_script(tmp_path, size):
+    path = tmp_path / 'job.lua'
+    path.write_text(ScriptGenerator(seed=3).generate(size), encoding='utf-8')
+    return str(path)
+
+def test_job_reports_timeout(tmp_path):
+    path = _write_script(tmp_path, 2_000_000)
+    record = batch.process_file((path, 0.05, str(tmp_path / 'cache'), False))
+    assert (record['status'], record['error']) == ('timeout', 'exceeded 0.05s')
+    assert record['elapsed'] < 1.0
+    assert not os.path.exists(batch.output_path(path))
+
+def test_timeout_during_cache_read(tmp_path, monkeypatch):
+    path, cache_dir = _write_script(tmp_path, 20_000), str(tmp_path / 'cache')
+    assert batch.process_file((path, None, cache_dir, False))['status'] == 'ok'
+    # The alarm lands while the cache is reading an entry, inside its OSError fallback
+    monkeypatch.setattr(cache.zlib, 'decompress', lambda data: time.sleep(5))
+    record = batch.process_file((path, 0.2, cache_dir, False))
+    assert record['status'] == 'timeout' and record['elapsed'] < 1.0
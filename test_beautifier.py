@@ -0,0 +1,57 @@
+import pytest
+
+from beautifier import beautify_lua, expand_fused, tokenize
+
+@pytest.mark.parametrize('code, chunks', [
+    ('print("a\\"b") x', [('code', 'print('), ('string', '"a\\"b"'), ('code', ') x')]),
+    # An escaped backslash does not escape the closing quote
+    ("s = '\\\\' .. t", [('code', 's = '), ('string', "'\\\\'"), ('code', ' .. t')]),
+    ('a = [==[ ]] "x" ]==] b', [('code', 'a = '), ('string', '[==[ ]] "x" ]==]'), ('code', ' b')]),
+    ('--[[ "x"\n]] y -- z "q"\nw', [('comment', '--[[ "x"\n]]'), ('code', ' y '), ('comment', '-- z "q"'), ('code', '\nw')]),
+    ('t[x[1]] = "s', [('code', 't[x[1]] = '), ('string', '"s')]),
+    ('x = [[ unclosed', [('code', 'x = '), ('code', '[[ unclosed')]),
+])
+def test_tokenize_protects_strings_and_comments(code, chunks):
+    assert list(tokenize(code)) == chunks
+
+def test_tokenize_unclosed_brackets_stay_linear():
+    code = '[[' * 200000 + '"'
+    assert ''.join(text for _, text in tokenize(code)) == code
+
+def test_beautify_keeps_strings_and_indents_blocks():
+    code = 'function f(a)if a then return "x  endlocal  y"end -- a  b\nend f(1)for i=1,2 do print(i)end'
+    assert beautify_lua(code) == (
+        'function f(a)\n'
+        '    if a then\n'
+        '        return "x  endlocal  y"\n'
+        '    end -- a  b\n'
+        'end f(1)\n'
+        'for i = 1, 2 do\n'
+        '    print(i)\n'
+        'end')
+
+@pytest.mark.parametrize('text, expected', [
+    ('endlocal x', 'end local x'),
+    ('localfunction f', 'local function f'),
+    ('ifnot x then', 'if not x then'),
+    ('thenreturn 1', 'then return 1'),
+    ('untiltrue', 'until true'),
+    ('andor', 'and or'),
+    ('endend', 'end end'),
+    ('elseif', 'else if'),
+    ('elseifx', 'else if x'),
+    # A safe keyword splits from an identifier on either side, a structural one only from a single trailing letter
+    ('localK', 'local K'),
+    ('returnnil', 'return nil'),
+    ('xlocal', 'x local'),
+    ('ends', 'end s'),
+    ('doprint(1)', 'doprint(1)'),
+    ('print(ender)', 'print(ender)'),
+    ('gotoend', 'gotoend'),
+    # A letter after a digit starts a new word
+    ('for i=1,10do', 'for i=1,10 do'),
+    ('1then', '1 then'),
+    ('a0local', 'a0 local'),
+])
+def test_expand_fused(text, expected):
+    assert expand_fused(text) == expected
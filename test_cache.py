@@ -0,0 +1,45 @@
+import os
+import random
+import time
+
+from cache import Cache, output_key, pool_key
+
+def _value(i):
+    return random.Random(i).randbytes(512).hex()  # incompressible enough to size entries
+
+def _disk_bytes(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+def test_round_trip(tmp_path):
+    cache = Cache(str(tmp_path))
+    cache.put('pools', 'ab12', {'1': 'x'})
+    assert cache.get('pools', 'ab12') == {'1': 'x'}
+    assert cache.get('pools', 'cd34') is None
+    assert cache.get('outputs', 'ab12') is None
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = Cache(str(tmp_path))
+    cache.put('pools', 'ab12', [1, 2])
+    with open(cache._path('pools', 'ab12'), 'wb') as f: f.write(b'not zlib')
+    assert cache.get('pools', 'ab12') is None
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = Cache(str(tmp_path), max_bytes=10**9)
+    cache.put('ns', 'size', _value(-1))
+    size = _disk_bytes(tmp_path)
+    cache.clear()
+    cache = Cache(str(tmp_path), max_bytes=int(size * 8.5))
+    now = time.time()
+    for i in range(6):
+        cache.put('ns', f'{i:02d}', _value(i))
+        os.utime(cache._path('ns', f'{i:02d}'), (now - 100 + i, now - 100 + i))
+    # Reading refreshes an entry, so the oldest unread ones go first
+    assert cache.get('ns', '00') == _value(0)
+    for i in range(6, 12): cache.put('ns', f'{i:02d}', _value(i))
+    assert cache.get('ns', '00') == _value(0) and cache.get('ns', '11') == _value(11)
+    assert cache.get('ns', '01') is None
+    assert _disk_bytes(tmp_path) <= cache.max_bytes
+
+def test_keys_separate_pools_and_variants():
+    assert pool_key(b'\x01', [1, 2]) != pool_key(b'\x01', [2, 1]) != pool_key(b'\x02', [2, 1])
+    assert output_key('print(1)', 'archive=True') != output_key('print(1)', 'archive=False')
@@ -0,0 +1,35 @@
+import sys
+
+import pytest
+
+import hex_tool
+import unvm
+from bench import ScriptGenerator, stage_inputs
+
+def _hints(monkeypatch, capsys, tmp_path, *paths):
+    monkeypatch.setattr(sys, 'argv', ['hex_tool.py', 'search', *map(str, paths), '--json', '-j', '1'])
+    hex_tool.main()
+    hints = tmp_path / 'hints.jsonl'
+    hints.write_text(capsys.readouterr().out, encoding='utf-8')
+    return hints
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_search_recovers_keys_and_pool(tmp_path, monkeypatch, capsys, seed):
+    script = ScriptGenerator(seed=seed).generate(30000)
+    path = tmp_path / 'script.lua'
+    path.write_text(script, encoding='utf-8')
+    _, pool, keys, _ = stage_inputs(script)
+    hints = _hints(monkeypatch, capsys, tmp_path, path)
+    found_keys, found_pool = unvm.load_hints(str(path), str(hints))
+    assert (found_keys, found_pool) == (keys, bytes(pool))
+    # The hints reproduce the output of a run that finds the keys and pool itself
+    assert unvm.deobfuscate(script, keys=found_keys, pool=found_pool)[0] == unvm.deobfuscate(script)[0]
+
+def test_hints_for_another_file_are_ignored(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'script.lua'
+    path.write_text(ScriptGenerator(seed=1).generate(20000), encoding='utf-8')
+    plain = tmp_path / 'plain.lua'
+    plain.write_text('print("' + 'hello world'.encode().hex() * 4 + '")', encoding='utf-8')
+    hints = _hints(monkeypatch, capsys, tmp_path, path, plain)
+    assert unvm.load_hints(str(plain), str(hints)) == (None, None)
+    assert unvm.load_hints(str(tmp_path / 'other.lua'), str(hints)) == (None, None)
@@ -0,0 +1,126 @@
+import re
+import sys
+import multiprocessing
+
+import pytest
+
+import incremental
+import parallel
+import unvm
+from bench import ScriptGenerator
+from incremental import Session
+from lua_lexer import TokenStream, parse_string, quote_string
+from profiler import PassProfiler
+from simplify_math import MAX_NESTING, ConstantFolder, fold_constants
+
+@pytest.mark.parametrize('code, expected', [
+    # Unary minus binds looser than ^, which is right-associative
+    ('print(-2^2)', 'print(-4)'),
+    ('print(2^-2)', 'print(0.25)'),
+    ('print(-x^2)', 'print(-x^2)'),
+    # A negative result keeps its parentheses in front of ^
+    ('print((1-2)^x)', 'print((-1)^x)'),
+    ('local n <const> = 5 print(n * 2)', 'local n <const> = 5 print(10)'),
+    ('local f = math.floor print(f(2.5))', 'local f = math.floor print(2)'),
+    # Any later assignment drops every fold that relied on the local
+    ('local n = 5 n = 6 print(n * 2)', 'local n = 5 n = 6 print(n * 2)'),
+    ('local n = 5 function g() n = 1 end print(n * 2)', 'local n = 5 function g() n = 1 end print(n * 2)'),
+    ('local f = math.floor f = print print(f(2.5))', 'local f = math.floor f = print print(f(2.5))'),
+    ('local n = 5 n += 1 print(n * 2)', 'local n = 5 n += 1 print(n * 2)'),
+    # Shadowing locals and parameters hide the outer constant in their scope only
+    ('local n = 5 do local n = x print(n * 2) end print(n * 2)', 'local n = 5 do local n = x print(n * 2) end print(10)'),
+    ('local n = 5 local function g(n) return n * 2 end print(n * 2)', 'local n = 5 local function g(n) return n * 2 end print(10)'),
+    # A truncated attribute is skipped like any statement the folder cannot read
+    ('local x <const', 'local x <const'),
+    ('local a, b <close', 'local a, b <close'),
+    ('local x <const print(1 + 1)', 'local x <const print(2)'),
+])
+def test_fold(code, expected):
+    assert fold_constants(code) == expected
+
+def test_fold_past_nesting_limit():
+    chain = ' .. '.join(['"x"'] * (MAX_NESTING + 50))
+    assert fold_constants(f'local a = 1 + 2\nlocal s = {chain}\nprint(a * 2)').endswith('print(6)')
+    # Only the statement nested too deep is left alone; it still declares its local
+    deep = '(' * (MAX_NESTING + 50) + '1 + 1' + ')' * (MAX_NESTING + 50)
+    out = fold_constants(f'local n = 2\nlocal d = {deep}\nprint(n * 2, d * 2)')
+    assert out.startswith('local n = 2\nlocal d = ((') and out.endswith('print(4, d * 2)')
+
+@pytest.mark.parametrize('value', ['plain "q" \\ \n\t\x00\x7f', 'h\xc3\xa9llo \xe2\x9c\x93', '\xff\xfe bad \xc3', 'mixed \xc3\xbc\x80'])
+def test_quote_string_round_trip(value):
+    assert parse_string(quote_string(value)) == value
+
+def test_quote_string_keeps_utf8():
+    assert quote_string('h\xc3\xa9llo\n') == '"héllo\\n"'
+    assert quote_string('\xc3') == '"\\195"'
+
+def _chunked_script():
+    """A wrapped main block long enough to split, with locals reassigned chunks after their use."""
+    parts = ['local k = 3\nlocal m = math.floor\n']
+    for i in range(60):
+        parts.append(f'local a{i} = {i} + 1\nprint(a{i} * k, m({i} / 2), "s" .. {i} * 2)\n')
+        if i == 30: parts.append('k = 4\n')
+        if i == 40: parts.append('local s = ' + ' .. '.join(['"x"'] * (MAX_NESTING + 50)) + '\n')
+    parts.append('m = print\n')
+    return 'return (function(...)\n' + ''.join(parts) + 'end)(...)\n'
+
+def test_parallel_fold_matches_serial(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_CHUNK_BYTES', 1)
+    code = _chunked_script()
+    with multiprocessing.Pool(2, parallel._init_worker, (code,)) as pool:
+        done = parallel.fold_parallel(code, pool, parallel.plan_chunks(code, 2))
+    assert done is not None, "the script was not split"
+    stream = TokenStream(code)
+    folder = ConstantFolder(stream)
+    folder.run()
+    assert (done[0].text(), done[1]) == (stream.text(), len(folder.edits))
+
+def test_watch_session_matches_fresh_run():
+    code = ScriptGenerator(minify=0, seed=1).generate(60000)
+    session = Session()
+    unvm.deobfuscate(code, session=session)
+    middle = re.compile(r'\n\s*local ').search(code, len(code) // 2).start()
+    edited = code[:middle] + '\nlocal zz = 1 + 2 * 3' + code[middle:]
+    output, _ = unvm.deobfuscate(edited, session=session)
+    assert output == unvm.deobfuscate(edited)[0]
+    assert session.stats['chunks_reused'] > 0
+
+@pytest.mark.parametrize('helper', [
+    'x = 1 H = function(a) return a end y = 2',
+    'local function H(a) if a then return "]]" end end; local z = 3',
+    '\n\nfunction H(a)\n\n  return a\n\nend  \n',
+])
+@pytest.mark.parametrize('options', [{}, {'remove_vm': True}, {'beautify': False}])
+def test_archive_streamed_matches_text_archive(helper, options):
+    code = ScriptGenerator(minify=1, seed=2).generate(20000).rstrip() + ' ' + helper
+    plain, info = unvm.deobfuscate(code, archive=False, **options)
+    expected = unvm.archive_vm(plain, [info['vm_function'], 'H'], lambda msg: None, PassProfiler(), options.get('remove_vm', False))
+    assert unvm.deobfuscate(code, vm_helpers=['H'], **options)[0] == expected
+
+def test_watch_retries_unreadable_file(tmp_path, monkeypatch):
+    path = tmp_path / 'script.lua'
+    path.write_bytes(b'print("\xff")')
+    runs, logs, polls = [], [], []
+
+    def sleep(seconds):
+        polls.append(seconds)
+        if len(polls) == 3: path.write_text('print(1)', encoding='utf-8')
+        if len(polls) == 5: raise KeyboardInterrupt
+
+    monkeypatch.setattr(incremental.time, 'sleep', sleep)
+    incremental.watch(str(path), runs.append, 0, logs.append)
+    assert runs == ['print(1)']
+    assert len([m for m in logs if m.startswith('Cannot read')]) == 1 and logs[-1] == "Stopped watching."
+
+def test_watch_run_reports_pipeline_errors(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'script.lua'
+    path.write_text('print(1)', encoding='utf-8')
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(unvm, 'iter_deobfuscate', fail)
+    monkeypatch.setattr(unvm, 'watch', lambda path, run, interval, log: [run('a'), run('b')])
+    monkeypatch.setattr(sys, 'argv', ['unvm.py', str(path), '--watch', '--no-cache'])
+    unvm.main()
+    assert capsys.readouterr().out.count("Failed: RuntimeError: boom") == 2
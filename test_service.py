@@ -0,0 +1,55 @@
+import json
+import threading
+import http.client
+
+import pytest
+
+import service
+from bench import ScriptGenerator
+
+@pytest.fixture(scope='module')
+def server():
+    server = service.make_server(port=0, workers=0, cache_dir=None)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _post(server, body, content_type='application/json', headers=None):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=30)
+    conn.putrequest('POST', '/deobfuscate')
+    conn.putheader('Content-Type', content_type)
+    for name, value in (headers or {'Content-Length': str(len(body))}).items(): conn.putheader(name, value)
+    conn.endheaders(body)
+    res = conn.getresponse()
+    status, reply = res.status, json.loads(res.read())
+    conn.close()
+    return status, reply
+
+def test_deobfuscate(server):
+    source = ScriptGenerator(seed=4).generate(5000)
+    status, reply = _post(server, json.dumps({'source': source, 'options': {'archive': False}}).encode())
+    assert status == 200 and reply['info']['strings'] > 0 and 'DECODED VM' not in reply['output']
+    status, reply = _post(server, source.encode(), 'text/plain')
+    assert status == 200 and 'DECODED VM' in reply['output']
+
+@pytest.mark.parametrize('request_body', [
+    {'source': 5},
+    {'source': 'print(1)', 'options': {'archive': 'false'}},
+    {'source': 'print(1)', 'options': {'beautify': 0}},
+    {'source': 'print(1)', 'options': {'backend': 'nope'}},
+    {'source': 'print(1)', 'options': ['archive']},
+    {'options': {}},
+])
+def test_rejects_bad_json(server, request_body):
+    status, reply = _post(server, json.dumps(request_body).encode())
+    assert status == 400 and reply['error'].startswith('bad request')
+
+@pytest.mark.parametrize('length', ['abc', '-5'])
+def test_rejects_bad_content_length(server, length):
+    status, reply = _post(server, b'print(1)', 'text/plain', {'Content-Length': length})
+    assert status == 400
+
+def test_undecodable_script(server):
+    assert _post(server, b'print(1)', 'text/plain')[0] == 422
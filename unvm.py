@@ -1,134 +1,493 @@
+import os
 import re
 import sys
-import ast
+import json
+import time
+import argparse
+import itertools
+
+from cache import Cache, pool_key, output_key
+from incremental import Session, watch
+from backends import BACKENDS, choose
+from lua_lexer import TokenStream, quote_string
+from parallel import MIN_BYTES, beautify_lines, fold as fold_stream
+from profiler import PassProfiler
+from simplify_math import fold_constants
 
 def simplify_math(text):
     """
     Ultimate safe math simplifier.
-    Only simplifies constant sequences that are fully delimited by non-math punctuation.
-    Prevents partial simplification of 'x + 1' or '(t-1) % 4 + 1'.
-    """
-    # 1. Inner parentheses reduction: ( 1 + 2 ) -> 3
-    # Safe because we replace the entire paren block.
-    inner_paren_pattern = r'\(\s*([\-\+]?\s*\d+\.?\d*(?:\s*[\+\-\*\/\%\^]\s*[\-\+]?\s*\d+\.?\d*)*)\s*\)'
-    
-    def repl_paren(m):
-        try:
-            expr = m.group(1)
-            val = eval(re.sub(r'\s+', '', expr), {"__builtins__": {}}, {})
-            if isinstance(val, (int, float)):
-                res = str(int(val)) if float(val).is_integer() else f"{val:.10f}".rstrip('0').rstrip('.')
-                return f" {res} "
-        except: pass
-        return m.group(0)
-
-    # 2. Flat sequences: 1 + 2 -> 3
-    # MUST be delimited by safe characters (assignments, parens, commas, semi-colons, newlines).
-    # Cannot be part of a larger math chain like 'x + 1' or '% 4 + 1'.
-    # Note: \s is NOT in safe_pre/post because we want to see what's BEHIND the space.
-    safe_pre = r'[\=\(\,\[\{\;\n\r]'
-    safe_post = r'[\)\,\;\n\r\]\}]'
-    
-    # Matches: (Start OR SafePre) + (Math Seq) + (Lookahead SafePost OR End)
-    flat_math_pattern = r'(^|' + safe_pre + r')(\s*[\-\+]?\s*\d+\.?\d*(?:\s*[\+\-\*\/\%\^]\s*[\-\+]?\s*\d+\.?\d*)+\s*)(?=' + safe_post + r'|$)'
-    
-    def repl_flat(m):
-        prefix = m.group(1)
-        expr = m.group(2).strip()
-        try:
-            # Safe evaluation
-            val = eval(re.sub(r'\s+', '', expr), {"__builtins__": {}}, {})
-            if isinstance(val, (int, float)):
-                res = str(int(val)) if float(val).is_integer() else f"{val:.10f}".rstrip('0').rstrip('.')
-                return f"{prefix} {res} "
-        except: pass
-        return m.group(0)
-
-    for _ in range(50):
-        prev = text
-        text = re.sub(inner_paren_pattern, repl_paren, text)
-        text = re.sub(flat_math_pattern, repl_flat, text)
-        if text == prev: break
-    return text
-
-def lua_vm_decode(hex_pool, keys, offset):
-    """Simulates XHider Lua VM decoding."""
-    def e(t, m):
-        res = 0
-        for k in range(8):
-            v_bit = t / 2 + m / 2
-            if v_bit != int(v_bit): res += 2**k
-            t = int(t // 2); m = int(m // 2)
-        return res
-    idx = int(offset) + 1
+    Parses expressions with Lua precedence and folds only fully constant subtrees,
+    so 'x + 1' or '(t-1) % 4 + 1' are never partially simplified.
+    """
+    return fold_constants(text)
+
+# Pass 2 scans the significant tokens of the stream as parallel (kinds, vals) lists, so strings
+# and comments can never produce false matches. The scans only need the start of string
+# literals, so values are clipped and the pool literal is never copied.
+CLIP = 64
+
+BLOCK_OPENERS = ('function', 'if', 'do', 'repeat')  # `while`/`for` open with their `do`
+BLOCK_CLOSERS = ('end', 'until')
+
+def _function_header(kinds, vals, p):
+    """(name, params) of the function whose keyword is at p; name is None for dotted or unbound functions."""
+    n = len(vals)
+    q, name = p + 1, None
+    if q < n and kinds[q] == 'name':
+        name = vals[q]
+        q += 1
+        if q < n and vals[q] in ('.', ':'): name = None
+        while q < n and vals[q] != '(': q += 1
+    elif p >= 2 and vals[p - 1] == '=' and kinds[p - 2] == 'name' and (p < 3 or vals[p - 3] not in ('.', ':', ',')):
+        name = vals[p - 2]  # `[local] NAME = function(...)`
+    params = []
+    q += 1
+    while q < n and vals[q] != ')':
+        if kinds[q] == 'name': params.append(vals[q])
+        q += 1
+    return name, params
+
+def index_functions(kinds, vals):
+    """
+    One pass over the significant tokens: tracks block depth to find the extent of every
+    function and, in the same loop, collects `name(123)` call sites.
+    Returns (functions, sites); each function is a dict with name, params, start and end
+    token positions and `guard` (its body tests `if not t[param]` for its single parameter);
+    sites maps every name called with one integer literal to its token positions.
+    """
+    functions, sites, stack = [], {}, []
+    n = len(vals)
+    for p in range(n):
+        k, v = kinds[p], vals[p]
+        if k == 'keyword':
+            if v in BLOCK_OPENERS:
+                fn = None
+                if v == 'function':
+                    name, params = _function_header(kinds, vals, p)
+                    fn = {'name': name, 'params': params, 'start': p, 'end': n - 1, 'guard': False}
+                    functions.append(fn)
+                stack.append(fn)
+            elif v in BLOCK_CLOSERS:
+                if stack:
+                    fn = stack.pop()
+                    if fn: fn['end'] = p
+            if v == 'if' and p + 5 < n and vals[p + 1] == 'not' and kinds[p + 2] == 'name' and vals[p + 3] == '[' \
+                    and vals[p + 5] == ']':
+                fn = next((f for f in reversed(stack) if f), None)
+                if fn and len(fn['params']) == 1 and vals[p + 4] == fn['params'][0]: fn['guard'] = True
+        elif k == 'name' and p + 3 < n and vals[p + 1] == '(' and vals[p + 3] == ')' \
+                and kinds[p + 2] == 'number' and vals[p + 2].isdigit():
+            sites.setdefault(v, []).append(p)
+    return functions, sites
+
+def find_call_sites(kinds, vals):
+    """Maps every name called with one integer literal, `name(123)`, to its token positions."""
+    return index_functions(kinds, vals)[1]
+
+def rank_vm_candidates(functions, sites):
+    """
+    Ranks possible VM decoder functions, best first, as dicts with name, calls, guard,
+    defined and confidence (share of the total score, 0-1).
+    A candidate scores its integer call-site count, doubled when it is defined here with the
+    `if not t[param]` cache guard, and halved when the file never defines it (e.g. `wait(1)`).
+    """
+    defined = {}
+    for f in functions:
+        if f['name'] and len(f['params']) == 1:
+            defined[f['name']] = defined.get(f['name'], False) or f['guard']
+    ranked = []
+    for name in set(sites) | {nm for nm, g in defined.items() if g}:
+        calls = len(sites.get(name, ()))
+        guard = defined.get(name, False)
+        score = calls * (2 if guard else 1) * (1 if name in defined else 0.5)
+        ranked.append({'name': name, 'calls': calls, 'guard': guard, 'defined': name in defined, 'score': score})
+    total = sum(c['score'] for c in ranked)
+    ranked.sort(key=lambda c: (-c['score'], not c['guard'], -c['calls'], c['name']))
+    for c in ranked: c['confidence'] = round(c.pop('score') / total, 3) if total else 0.0
+    return ranked
+
+def load_hints(path, hints_file):
+    """
+    (keys, pool bytes) of the best XHider candidate for path in `hex_tool.py search --json`
+    output, or (None, None) when the file has none.
+    """
+    target, best = os.path.abspath(path), None
+    with open(hints_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec.get('kind') == 'xhider' and rec['file'] == target and (not best or rec['score'] > best['score']):
+                best = rec
+    if not best: return None, None
+    with open(path, 'rb') as f:
+        f.seek(best['offset'])
+        digits = f.read((best['end'] - best['offset']) & ~1)
+    return best['keys'], bytes.fromhex(digits.decode('ascii'))
+
+def output_path(path):
+    """Destination of the de-obfuscated script for an input path."""
+    return path.replace(".lua", ".unvm.lua")
+
+def deobfuscate(code, log=None, **options):
+    """
+    Runs the six-pass pipeline over Lua source. Pure: no files, argv or stdout are touched.
+    Returns (final_code, info); info holds the decoder backend, VM function, keys, decoded
+    string count and per-pass wall times. Raises ValueError when the hex pool or keys are missing.
+    The backend is picked by fingerprinting the folded tokens (see backends.detect()) unless
+    `backend` names one of backends.BACKENDS.
+    With a cache.Cache, identical inputs and previously seen (pool, keys) pairs skip their passes.
+    Pass a profiler.PassProfiler to collect detailed per-pass statistics (sizes, counters, memory).
+    beautify=False returns the reconstructed text as-is; archive=False leaves the VM uncommented.
+    remove_vm=True deletes the VM instead of commenting it; vm_helpers names more functions to treat alike.
+    keys / pool (bytes) skip their detection in Pass 2, e.g. from load_hints().
+    workers=N runs Passes 1 and 5 of inputs over parallel.MIN_BYTES on N processes; the output is the same.
+    session=incremental.Session() carries work over to the next call with the same session
+    (e.g. after an edit of the script), so unchanged chunks, strings and code runs are not
+    processed again; the output is the same.
+    string_table={} is filled with {offset: Lua literal} for every decoded string (see
+    write_string_table()); it stays empty when the output comes from the cache.
+    """
+    info = {}
+    final_code = ''.join(iter_deobfuscate(code, info, log, **options))
+    return final_code, info
+
+def iter_deobfuscate(code, info, log=None, cache=None, profiler=None, beautify=True, archive=True,
+                     remove_vm=False, vm_helpers=(), keys=None, pool=None, workers=None, backend=None,
+                     session=None, string_table=None):
+    """
+    deobfuscate() as a generator of output text pieces, so the result can be written out
+    (see write_output()) without ever being held whole. `info` is filled in place and is
+    complete once the generator is exhausted.
+    """
+    log = log or (lambda msg: None)
+    detailed = profiler is not None
+    prof = profiler or PassProfiler()
+    out_key = None
+    if cache:
+        out_key = output_key(code, f"beautify={beautify},archive={archive},remove_vm={remove_vm},helpers={sorted(vm_helpers)}"
+                             + (f",backend={backend}" if backend else "")
+                             + (f",hints={pool_key(pool or b'', keys or [])}" if keys or pool else ""))
+        hit = cache.get('outputs', out_key)
+        if hit:
+            log("Cache hit: reusing previous output.")
+            info.update(hit['info'], cached=True)
+            yield hit['output']
+            return
+    info.update(backend=None, vm_function=None, vm_candidates=[], keys=None, strings=0, timings={}, cached=False)
+
+    split = workers if workers and workers > 1 and len(code) >= MIN_BYTES else None
+    if session is not None: session.stats.clear()
+
+    # Passes 1-4 edit one shared token stream; text is only materialized by the beautifier
+    log("Step 1: Math Simplification...")
+    prof.start('math', input_bytes=len(code))
+    stream, replaced = fold_stream(code, split, session)
+    # The folder reaches its fixed point in a single traversal
+    prof.end(rounds=1, replacements_per_round=[replaced], tokens=len(stream),
+             **({'output_bytes': stream.size()} if detailed else {}))
+
+    log("Step 2: Component Extraction...")
+    prof.start('extract')
+    sig = stream.significant()
+    kinds = [stream.kind(i) for i in sig]
+    vals = stream.values(sig, clip=CLIP)
+    decoder, score = choose(stream, backend)
+    info['backend'] = decoder.name
+    log(f"Backend: {decoder.name}" + (f" (fingerprint score {score})" if score else " (default)" if score == 0 else ""))
+    hex_pool, keys = decoder.extract(stream, sig, kinds, vals, keys, pool)
+    info['keys'] = keys
+
+    functions, sites = index_functions(kinds, vals)
+    candidates = rank_vm_candidates(functions, sites)
+    info['vm_candidates'] = candidates[:5]
+    m_name = candidates[0]['name'] if candidates and candidates[0]['calls'] else None
+    info['vm_function'] = m_name
+    if m_name:
+        log(f"VM Function: {m_name} (confidence {candidates[0]['confidence']:.0%})")
+        for c in candidates[1:5]: log(f"  also considered: {c['name']} ({c['confidence']:.0%}, {c['calls']} calls)")
+    else:
+        log("VM Function: not found, no strings will be decoded.")
+    vm_names = ([m_name] if m_name else []) + list(vm_helpers)
+    # Pass 6 locates the VM on these tokens, so the output can be streamed past it
+    vm_spans = [(sig[p], sig[q] + 1) for p, q in definition_spans(vals, functions, set(vm_names))] if archive else []
+    prof.end(backend=decoder.name, pool_bytes=len(hex_pool), vm_function=m_name, call_sites=len(sites.get(m_name, ())),
+             functions=len(functions), candidates=len(candidates))
+
+    log("Step 3: String De-obfuscation...")
+    vm_sites = sites.get(m_name, [])
+    calls = sorted(set(int(vals[p + 2]) for p in vm_sites))
+    prof.start('decode')
+    results = {}
+    p_key = pool_key(hex_pool, keys, decoder.name) if cache or session else None
+    if session and p_key in session.pools: results = session.pools[p_key]
+    elif cache: results = {int(o): v for o, v in (cache.get('pools', p_key) or {}).items()}
+    missing = [o for o in calls if o not in results]
+    if missing:
+        results.update(decoder.decode_all(hex_pool, keys, missing))
+        if cache: cache.put('pools', p_key, results)
+    if session: session.pools = {p_key: results}
+    wanted = set(calls)
+    results = {k: v for k, v in results.items() if v and k in wanted}
+    info['strings'] = len(results)
+    prof.end(calls_found=len(calls), decoded=len(results), cache_hits=len(calls) - len(missing))
+
+    log("Pass 4: Reconstructing script...")
+    prof.start('reconstruct')
+    # Each string is escaped once, however many call sites use it
+    literals = {o: quote_string(v) for o, v in results.items()}
+    if string_table is not None: string_table.update(literals)
+    # The sites are `name(<int>)` token runs from the Pass 2 index, which never looks inside strings or comments
+    edits = []
+    for p in vm_sites:
+        o = int(vals[p + 2])
+        if o in literals: edits.append((sig[p], sig[p + 3] + 1, literals[o]))
+    stream.splice(edits)
+    # Each call site became one string token
+    vm_spans = [tuple(i - sum(j - k - 1 for k, j, _ in edits if j <= i) for i in span) for span in vm_spans]
+    prof.end(replacements=len(edits), literals=len(literals), **({'output_bytes': stream.size()} if detailed else {}))
+    # Only the stream is needed from here on
+    del sig, kinds, vals, functions, sites, vm_sites, results, literals, edits, hex_pool
+
+    # Pass 6 marks each VM function's tokens as a region of the output (see TokenStream.chunks())
+    marks = [m for r, (a, b) in enumerate(vm_spans) for m in ((a, r), (b, None))] if archive and vm_names else None
+    if not beautify: pieces = stream.pieces() if marks is None else _tagged(stream.chunks(marks))
+    else:
+        log("Pass 5: Beautification...")
+        prof.start('beautify')
+        if marks is None:
+            pieces = _measured(_joined(beautify_lines(stream, split, session)), lambda size: prof.end(output_bytes=size))
+        else:
+            pieces = _measured(beautify_lines(stream, split, session, marks), lambda size: prof.end(output_bytes=size),
+                               lambda piece: len(piece[1]))
+    if marks is not None: pieces = iter_archive_regions(pieces, log, prof, remove_vm)
+
+    kept = [] if out_key else None
+    for piece in pieces:
+        if kept is not None: kept.append(piece)
+        yield piece
+    info['timings'] = prof.timings()
+    if session is not None: info['incremental'] = dict(session.stats)
+    if out_key: cache.put('outputs', out_key, {'output': ''.join(kept), 'info': info})
+
+def write_string_table(literals, path):
+    """
+    Writes {offset: Lua literal} as sorted `offset<TAB>literal` lines, in UTF-8. Literals
+    escape their newlines, one per line; lua_lexer.parse_string() reads them back.
+    """
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.writelines(f"{o}\t{literals[o]}\n" for o in sorted(literals))
+
+def _joined(lines):
+    """The pieces of "\n".join(lines)."""
+    lines = iter(lines)
+    for line in lines:
+        yield line
+        break
+    for line in lines: yield "\n" + line
+
+def _measured(pieces, done, measure=len):
+    """Passes pieces through, then calls done(total length) once they are exhausted."""
+    size = 0
+    for piece in pieces:
+        size += measure(piece)
+        yield piece
+    done(size)
+
+def _tagged(chunks):
+    """(key, text) pieces of TokenStream.chunks(marks), as beautifier.iter_marked() yields them."""
+    key = None
+    for kind, content in chunks:
+        if kind == 'mark': key = content
+        else: yield key, content
+
+def write_output(pieces, path):
+    """
+    Writes text pieces to path as they are produced, or to stdout when path is '-'.
+    A file is written under a temporary name and renamed at the end, so a failed run
+    never leaves a truncated output behind.
+    """
+    if path == '-':
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stdout.writelines(pieces)
+        sys.stdout.flush()
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
     try:
-        b = [hex_pool[idx-1], hex_pool[idx], hex_pool[idx+1], hex_pool[idx+2]]
-        length = e(b[0], keys[0]) + e(b[1], keys[1])*256 + e(b[2], keys[2])*65536 + e(b[3], keys[3])*16777216
-        return "".join(chr(e(hex_pool[idx + 4 + i - 1], keys[i % 4])) for i in range(length))
-    except: return None
+        with open(tmp, 'w', encoding='utf-8') as f: f.writelines(pieces)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+# Lookahead, so overlapping brackets such as `]]=]` are all seen
+BRACKET_RE = re.compile(r'(?=\[(=*)\[|\](=*)\])')
+
+def long_bracket_level(text):
+    """Smallest n such that text contains neither [=n[ nor ]=n], found in one scan."""
+    used = {len(a if a is not None else b) for a, b in BRACKET_RE.findall(text)}
+    n = 0
+    while n in used: n += 1
+    return n
+
+def definition_spans(vals, functions, names):
+    """
+    Significant-token spans (p, q), both inclusive, of the outermost definitions of the named
+    functions among index_functions() results, in order. Extents come from the keyword-depth
+    index, so nested closures stay inside their function and the span ends at its own `end`
+    (plus a trailing `;`).
+    """
+    spans = []
+    for f in functions:
+        if f['name'] not in names or (spans and f['start'] <= spans[-1][1]): continue
+        p, q = f['start'], f['end']
+        if p >= 2 and vals[p - 1] == '=': p -= 2  # `NAME = function`
+        if p >= 1 and vals[p - 1] == 'local': p -= 1
+        if q + 1 < len(vals) and vals[q + 1] == ';': q += 1
+        spans.append((p, q))
+    return spans
+
+def function_spans(code, names):
+    """Character spans of the outermost definitions of the named functions in code; see definition_spans()."""
+    stream = TokenStream(code)
+    sig = stream.significant()
+    kinds = [stream.kind(i) for i in sig]
+    vals = stream.values(sig, clip=CLIP)
+    functions = index_functions(kinds, vals)[0]
+    return [(stream.starts[sig[p]], stream.ends[sig[q]]) for p, q in definition_spans(vals, functions, names)]
+
+def _archived(inner, remove):
+    """The replacement of one VM function's text: a long-bracket comment holding it, or nothing."""
+    if remove: return ""
+    eq = "=" * long_bracket_level(inner)
+    return f"--[{eq}[ DECODED VM\n{inner}\n]{eq}]"
+
+def archive_vm(final_code, names, log, prof, remove=False):
+    """Pass 6: wraps every named VM function in a long-bracket comment (or drops it) in one sweep."""
+    return "".join(iter_archive_vm(final_code, names, log, prof, remove))
+
+def iter_archive_vm(final_code, names, log, prof, remove=False):
+    """archive_vm() as a generator of output pieces, slices of final_code between the archived blocks."""
+    log("Pass 6: Wrapping VM in comments..." if not remove else "Pass 6: Removing VM functions...")
+    prof.start('archive', input_bytes=len(final_code))
+    last, size = 0, 0
+    spans = function_spans(final_code, set(names))
+    for s, e in spans:
+        yield final_code[last:s]
+        size += s - last
+        block = _archived(final_code[s:e], remove)
+        yield block
+        size += len(block)
+        last = e
+    yield final_code[last:]
+    prof.end(blocks=len(spans), output_bytes=size + len(final_code) - last)
+
+def iter_archive_regions(pieces, log, prof, remove=False):
+    """
+    iter_archive_vm() over (key, text) pieces whose keyed regions are the VM functions, e.g. from
+    beautifier.iter_marked(): text outside them passes straight through, so only one function
+    is held at a time.
+    """
+    log("Pass 6: Wrapping VM in comments..." if not remove else "Pass 6: Removing VM functions...")
+    region, inner, blocks, size, out = None, [], 0, 0, 0
+    # The trailing empty piece closes a region that runs to the end
+    for key, text in itertools.chain(pieces, [(None, '')]):
+        size += len(text)
+        if key != region and inner:
+            block = _archived(''.join(inner), remove)
+            yield block
+            out += len(block)
+            blocks, inner = blocks + 1, []
+        region = key
+        if key is not None: inner.append(text)
+        elif text:
+            yield text
+            out += len(text)
+    # The regions are archived as Pass 5 streams by, so their time is counted there
+    prof.start('archive', input_bytes=size)
+    prof.end(blocks=blocks, output_bytes=out)
 
 def main():
-    if len(sys.argv) < 2: print("Usage: py unvm.py <file>"); return
-    with open(sys.argv[1], 'r', encoding='utf-8') as f: code = f.read()
-
-    print("Step 1: Math Simplification...")
-    code = simplify_math(code)
-
-    print("Step 2: Component Extraction...")
-    hex_m = re.search(r'["\']([0-9a-fA-F]{200,})["\']', code)
-    if not hex_m: print("Hex pool not found."); return
-    hex_pool = list(bytes.fromhex(hex_m.group(1)))
-
-    q_m = re.search(r'\{\s*(\d+)\s*[,;]\s*(\d+)\s*[,;]\s*(\d+)\s*[,;]\s*(\d+)', code)
-    if not q_m: q_m = re.search(r'(\d+)\s*[,;]\s*(\d+)\s*[,;]\s*(\d+)\s*[,;]\s*(\d+)', code)
-    if not q_m: print("Keys not found."); return
-    keys = [int(q_m.group(i)) for i in range(1, 5)]
-    
-    m_name = None
-    m_func_match = re.search(r'function\s+([a-zA-Z0-9_]+)\s*\(([a-zA-Z0-9_]+)\)(?:(?!function).)+?if\s+not\s+[a-zA-Z0-9_]+\[\2\]', code, re.DOTALL)
-    if m_func_match: m_name = m_func_match.group(1)
-    counts = {}
-    for match in re.finditer(r'([a-zA-Z0-9_]+)\(\d+\)', code):
-        n = match.group(1); counts[n] = counts.get(n, 0) + 1
-    if counts:
-        most = max(counts, key=counts.get)
-        if not m_name or counts[most] > counts.get(m_name, 0) * 2: m_name = most
-    if not m_name: m_name = 'm'
-    print(f"VM Function: {m_name}")
-
-    print("Step 3: String De-obfuscation...")
-    calls = sorted(list(set([int(c) for c in re.findall(r'\b' + m_name + r'\((\d+)\)', code)])))
-    results = {o: lua_vm_decode(hex_pool, keys, o) for o in calls}
-    results = {k: v for k, v in results.items() if v}
-
-    print("Pass 4: Reconstructing script...")
-    def repl_call(m):
-        o = int(m.group(1))
-        if o in results:
-            s = results[o].replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
-            return f'"{s}"'
-        return m.group(0)
-    final_code = re.sub(r'\b' + m_name + r'\((\d+)\)', repl_call, code)
-    
-    print("Pass 5: Beautification...")
-    from beautifier import beautify_lua
-    final_code = beautify_lua(final_code)
-
-    print("Pass 6: Wrapping VM in comments...")
-    def comment_block(match):
-        inner = match.group(0).strip()
-        if "[[" in inner or "]]" in inner:
-            eq = "="
-            while f"]{eq}]" in inner or f"[{eq}[" in inner: eq += "="
-            h, f = f"--[{eq}[ DECODED VM", f"]{eq}]"
-        else: h, f = "--[[ DECODED VM", "]]"
-        return f"{h}\n{inner}\n{f}"
-
-    # Specifically capture the VM function block
-    final_code = re.sub(r'(function\s+' + m_name + r'\(.+?end\s*;?\s*end\s*;?)', comment_block, final_code, flags=re.DOTALL)
-
-    out = sys.argv[1].replace(".lua", ".unvm.lua")
-    with open(out, 'w', encoding='utf-8') as f: f.write(final_code)
-    print(f"Success! Output: {out}")
+    parser = argparse.ArgumentParser(description="De-obfuscate an XHider-protected Lua script.")
+    parser.add_argument('file', nargs='?')
+    parser.add_argument('--no-cache', action='store_true', help="bypass the on-disk cache")
+    parser.add_argument('--clear-cache', action='store_true', help="empty the on-disk cache first")
+    parser.add_argument('--cache-dir', default=None, help="cache location (default: ~/.cache/unvm)")
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help="write per-pass time, CPU, peak memory and counters as JSON ('-' for stdout)")
+    parser.add_argument('--remove-vm', action='store_true', help="delete the VM function instead of commenting it out")
+    parser.add_argument('--vm-helper', metavar='NAME', action='append', default=[],
+                        help="also archive (or remove) this function; repeatable")
+    parser.add_argument('--hints', metavar='FILE', default=None,
+                        help="take the hex pool and keys from `hex_tool.py search --json` output")
+    parser.add_argument('--trace', action='store_true', help="stream pass start/end events as JSON lines to stderr")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="fold and format big scripts on this many processes (default: 1)")
+    parser.add_argument('-o', '--output', metavar='FILE', default=None,
+                        help="where to write the result, '-' for stdout (default: <file>.unvm.lua)")
+    parser.add_argument('--backend', choices=list(BACKENDS), default=None,
+                        help="decoder to use instead of fingerprinting the script")
+    parser.add_argument('--strings', metavar='FILE', default=None,
+                        help="also write the decoded strings as `offset<TAB>literal` lines, sorted by offset")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running, and update the output whenever the file changes")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between checks in --watch mode")
+    args = parser.parse_args()
+    if args.watch and (args.profile or args.hints):
+        parser.error("--watch cannot be combined with --profile or --hints")
+
+    cache = None if args.no_cache else Cache(args.cache_dir)
+    if args.clear_cache:
+        Cache(args.cache_dir).clear()
+        print("Cache cleared.")
+    if not args.file:
+        if not args.clear_cache: print("Usage: py unvm.py <file> [--no-cache] [--clear-cache]")
+        return
+    hook = (lambda ev: print(json.dumps(ev), file=sys.stderr, flush=True)) if args.trace else None
+    # A profiled run measures the passes, and the string table comes from Pass 4, so neither answers from the output cache
+    if args.profile or args.trace or args.strings: cache = None
+    options = dict(cache=cache, remove_vm=args.remove_vm, vm_helpers=args.vm_helper, workers=args.workers,
+                   backend=args.backend)
+    out = args.output or output_path(args.file)
+    log = print if '-' not in (args.profile, out) else (lambda msg: print(msg, file=sys.stderr))
+
+    if args.watch:
+        session = Session()
+
+        def run(code):
+            start = time.perf_counter()
+            profiler = PassProfiler(hook=hook, memory=False) if args.trace else None
+            table = {} if args.strings else None
+            try: write_output(iter_deobfuscate(code, {}, log, profiler=profiler, session=session,
+                                               string_table=table, **options), out)
+            except ValueError as e: log(e); return
+            # Any other failure is this version's alone; the next save gets a fresh run
+            except Exception as e: log(f"Failed: {type(e).__name__}: {e}"); return
+            if args.strings: write_string_table(table, args.strings)
+            stats = session.stats
+            log(f"Updated {out} in {time.perf_counter() - start:.2f}s (reused {stats.get('chunks_reused', 0)}/"
+                f"{stats.get('chunks', 0)} chunks, {stats.get('runs_reused', 0)}/{stats.get('runs', 0)} code runs)")
+
+        log(f"Watching {args.file} (Ctrl-C to stop)...")
+        watch(args.file, run, args.interval, log)
+        return
+
+    with open(args.file, 'r', encoding='utf-8') as f: code = f.read()
+    keys, pool = load_hints(args.file, args.hints) if args.hints else (None, None)
+    profiler = PassProfiler(hook=hook, memory=bool(args.profile)) if args.profile or args.trace else None
+    table = {} if args.strings else None
+    try: write_output(iter_deobfuscate(code, {}, log, profiler=profiler, keys=keys, pool=pool,
+                                       string_table=table, **options), out)
+    except ValueError as e: log(e); return
+    finally:
+        if args.profile:
+            report = json.dumps(dict(profiler.report(), file=args.file), indent=2)
+            if args.profile == '-': print(report)
+            else:
+                with open(args.profile, 'w', encoding='utf-8') as f: f.write(report + "\n")
+
+    if args.strings:
+        write_string_table(table, args.strings)
+        log(f"Strings: {args.strings} ({len(table)} entries)")
+    if out != '-': log(f"Success! Output: {out}")
 
 if __name__ == "__main__": main()